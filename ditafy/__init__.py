@@ -0,0 +1,5 @@
+# Shared conversion engine used by the DITAfy front-ends.
+
+# Bump whenever a change alters the generated DITA, so cached outputs from
+# earlier versions are rebuilt.
+CONVERTER_VERSION = '0.13'
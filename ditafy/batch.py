@@ -0,0 +1,597 @@
+import argparse
+import glob
+import io
+import json
+import os
+import queue
+import threading
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, as_completed, wait
+from contextlib import nullcontext
+from dataclasses import replace
+
+from ditafy.cache import MANIFEST_NAME, BuildManifest, build_fingerprint
+from ditafy.converter import (AUTO_TOPIC, TASK, TOPIC_TYPES, ConversionOptions, convert_docx, convert_docx_topics,
+                              dita_id, serialize_topic, write_topic)
+from ditafy.images import DEFAULT_NAME_TEMPLATE, ImageWriter
+from ditafy.inline import INLINE_ELEMENTS, load_character_styles
+from ditafy.keywords import KEYREF_ELEMENTS, build_keys_map
+from ditafy.preferences import DEFAULT_PROFILE, PreferencesStore, compiled_matcher
+from ditafy.profiling import ENV_VAR, JsonLinesWriter, StageProfiler, profile_target_from_env
+from ditafy.review import decisions_path_for, load_decisions, options_with_decisions
+from ditafy.splitter import split_docx, topic_dir_for
+from ditafy.styles import load_rules, load_style_roles
+from ditafy.tables import AUTO, TABLE_FORMATS
+from ditafy.writer import write_dita
+
+KEYS_MAP_NAME = 'keys.ditamap'
+
+# Per-process state, set once by _init_worker so the keyword matcher is
+# compiled once per worker rather than once per file, and one image writer
+# (and its thread pool) serves every document the worker converts.
+_worker_options = None
+_worker_images = None
+_worker_topic_types = None
+_worker_decisions = False
+
+
+def task_id_from_path(path):
+    # Derive a valid DITA id from the file name, e.g. "02 Install Pump.docx"
+    # becomes "_02-Install-Pump".
+    return dita_id(os.path.splitext(os.path.basename(path))[0])
+
+
+def _glob_root(pattern):
+    # Leading part of a glob pattern without wildcards, e.g. "docs" for
+    # "docs/**/*.docx"; matches keep their layout below it
+    parts = []
+    for part in os.path.dirname(pattern).replace(os.sep, '/').split('/'):
+        if glob.has_magic(part):
+            break
+        parts.append(part)
+    return '/'.join(parts) or os.curdir
+
+
+def collect_inputs(patterns):
+    # Expand files, directories and globs into (docx_path, relative_path)
+    # pairs. Directories are searched recursively and keep their layout, as
+    # do glob matches below the pattern's first wildcard.
+    seen = set()
+    inputs = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [(path, os.path.relpath(path, pattern))
+                       for path in glob.glob(os.path.join(pattern, '**', '*.docx'), recursive=True)]
+        else:
+            root = _glob_root(pattern)
+            matches = [(path, os.path.relpath(path, root))
+                       for path in glob.glob(pattern, recursive=True)]
+        for path, relative in sorted(matches):
+            name = os.path.basename(path)
+            # Skip Word's "~$" lock files and anything that is not a .docx
+            if name.startswith('~$') or not name.lower().endswith('.docx'):
+                continue
+            key = os.path.abspath(path)
+            if key not in seen:
+                seen.add(key)
+                inputs.append((path, relative))
+    return inputs
+
+
+def dita_path_for(docx_path, relative, output_dir, extension='.dita'):
+    if output_dir is None:
+        return os.path.splitext(docx_path)[0] + extension
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+
+
+def topic_paths_for(dita_path, topic_types):
+    # "guide.dita" becomes "guide.task.dita", "guide.concept.dita", ...
+    stem = os.path.splitext(dita_path)[0]
+    return {topic_type: f'{stem}.{topic_type}.dita' for topic_type in topic_types}
+
+
+def parse_topic_types(value):
+    # --topic-type: 'auto' or a comma-separated list of topic types
+    topic_types = [topic_type.strip() for topic_type in value.split(',') if topic_type.strip()]
+    if topic_types == [AUTO_TOPIC]:
+        return topic_types
+    unknown = [topic_type for topic_type in topic_types if topic_type not in TOPIC_TYPES]
+    if unknown or not topic_types:
+        raise argparse.ArgumentTypeError(
+            f"expected {AUTO_TOPIC} or a comma-separated list of {', '.join(TOPIC_TYPES)}")
+    return list(dict.fromkeys(topic_types))
+
+
+def _init_worker(keyword_replacements, options, image_settings=None, topic_types=None, decisions=False, keyref=None):
+    global _worker_options, _worker_images, _worker_topic_types, _worker_decisions
+    # Compiled by the parent already, so usually loaded from the matcher cache
+    _worker_options = replace(options, keyword_matcher=compiled_matcher(keyword_replacements, keyref))
+    _worker_images = ImageWriter(**image_settings) if image_settings else None
+    # Several types are written to one file each; a single type keeps the
+    # plain .dita name and comes from options.topic_type
+    _worker_topic_types = topic_types if topic_types and len(topic_types) > 1 else None
+    # Answer note and short description questions from each input's
+    # decisions file, when it has one
+    _worker_decisions = decisions
+
+
+def _convert_one(docx_path, dita_path, data=None):
+    # With data, the .docx bytes read ahead by convert_pipelined, outputs
+    # are not written here but returned for its writer stage: topics
+    # serialized in result['files'] and images in result['images'].
+    start = time.perf_counter()
+    files = []
+    images = []
+    # Every file written for the input, for the build manifest
+    outputs = [dita_path]
+    profile = None
+    try:
+        task_id = task_id_from_path(docx_path)
+        options = _worker_options
+        profiler = options.profiler
+        if _worker_images is not None:
+            # Split topics all live in one folder, so any path in it gives
+            # the same relative hrefs
+            topic_path = os.path.join(topic_dir_for(dita_path), 'topic.dita') if options.split_level else dita_path
+            options = replace(options, include_images=True,
+                              save_image=_worker_images.saver(task_id, topic_path))
+        if _worker_decisions and os.path.exists(decisions_path_for(docx_path)):
+            options = options_with_decisions(options, load_decisions(decisions_path_for(docx_path)))
+        source = docx_path if data is None else io.BytesIO(data)
+        with profiler.document(docx_path) if profiler is not None else nullcontext() as profile:
+            if options.split_level:
+                # Split topics are streamed to disk as they are built
+                os.makedirs(os.path.dirname(os.path.abspath(dita_path)), exist_ok=True)
+                ditamap = split_docx(source, dita_path, task_id, options, options.split_level)
+                outputs += [os.path.join(os.path.dirname(dita_path), topicref.get('href'))
+                            for topicref in ditamap.iter('topicref')]
+            else:
+                if _worker_topic_types is not None:
+                    paths = topic_paths_for(dita_path, _worker_topic_types)
+                    topics = convert_docx_topics(source, task_id, _worker_topic_types, options)
+                    roots = [(paths[topic_type], root) for topic_type, root in topics.items()]
+                    outputs = [path for path, _ in roots]
+                else:
+                    roots = [(dita_path, convert_docx(source, task_id, options))]
+                for path, root in roots:
+                    if data is None:
+                        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+                        write_topic(root, path, options)
+                    else:
+                        files.append((path, serialize_topic(root, options)))
+            if _worker_images is not None:
+                if data is None:
+                    _worker_images.flush()
+                else:
+                    images = _worker_images.take_deferred()
+        error = None
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        if profile is not None:
+            profiler.take_records()
+        keys = _worker_options.keyword_matcher.take_referenced()
+    result = {
+        'input': docx_path,
+        'output': dita_path,
+        'ok': error is None,
+        'error': error,
+        'seconds': round(time.perf_counter() - start, 4),
+        'outputs': outputs,
+    }
+    if profile is not None:
+        result['profile'] = profile
+    if _worker_options.keyword_matcher.keyref is not None:
+        result['keys'] = sorted(keys)
+    if data is not None:
+        result['files'] = files
+        result['images'] = images
+    return result
+
+
+def convert_batch(jobs, keyword_replacements, options, workers=None, on_result=None, image_settings=None,
+                  topic_types=None, decisions=False, keyref=None):
+    # Convert (docx_path, dita_path) pairs. With workers=1 everything runs in
+    # this process, otherwise on a process pool. A failing file never stops
+    # the batch; its error is recorded in the result instead. image_settings
+    # are ImageWriter arguments; without them images are skipped. With more
+    # than one topic type, each is written next to dita_path as
+    # <stem>.<type>.dita from a single read of the input. With decisions,
+    # notes and short descriptions are accepted or rejected as recorded in
+    # each input's decisions file (see ditafy.review.decisions_path_for).
+    # With keyref, keyword replacement values are key names (see
+    # KeywordMatcher) and result['keys'] lists the keys each output uses.
+    results = []
+    if workers == 1:
+        _init_worker(keyword_replacements, options, image_settings, topic_types, decisions, keyref)
+        try:
+            for docx_path, dita_path in jobs:
+                result = _convert_one(docx_path, dita_path)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+        finally:
+            if _worker_images is not None:
+                _worker_images.close()
+        return results
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(keyword_replacements, options, image_settings, topic_types,
+                                       decisions, keyref)) as executor:
+        futures = {executor.submit(_convert_one, docx_path, dita_path): (docx_path, dita_path)
+                   for docx_path, dita_path in jobs}
+        for future in as_completed(futures):
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker itself died (e.g. killed or out of memory)
+                docx_path, dita_path = futures[future]
+                result = {'input': docx_path, 'output': dita_path, 'ok': False,
+                          'error': f"{type(e).__name__}: {e}", 'seconds': None}
+            results.append(result)
+            if on_result:
+                on_result(result)
+    return results
+
+
+def _write_file(path, data):
+    # Write through a temporary name so readers never see a partial file
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def convert_pipelined(jobs, keyword_replacements, options, workers=None, on_result=None, image_settings=None,
+                      topic_types=None, prefetch=8, decisions=False, keyref=None):
+    """Convert like convert_batch, with reading and writing overlapping the conversions.
+
+    A reader thread loads up to prefetch .docx files ahead of the worker
+    processes, which convert from memory and hand back serialized topics
+    and images. A writer thread writes those while the workers move on.
+    Every stage is bounded, so a slow disk or slow workers hold the other
+    stages back instead of filling memory. Split documents are still
+    written by the workers, as their topics are streamed to disk.
+    """
+    workers = workers or os.cpu_count() or 1
+    read_queue = queue.Queue(maxsize=prefetch)
+    write_queue = queue.Queue(maxsize=prefetch)
+    results = []
+    writer_errors = []
+    stop = threading.Event()
+
+    def read():
+        for docx_path, dita_path in jobs:
+            if stop.is_set():
+                break
+            try:
+                with open(docx_path, 'rb') as f:
+                    item = (docx_path, dita_path, f.read(), None)
+            except OSError as e:
+                item = (docx_path, dita_path, None, f"{type(e).__name__}: {e}")
+            read_queue.put(item)
+        read_queue.put(None)
+
+    image_writer = ImageWriter(**image_settings) if image_settings else None
+
+    def write():
+        try:
+            while True:
+                result = write_queue.get()
+                if result is None:
+                    break
+                start = time.perf_counter()
+                files = result.pop('files', ())
+                images = result.pop('images', ())
+                if result['ok']:
+                    try:
+                        for blob, path in images:
+                            image_writer.write(blob, path)
+                        for path, data in files:
+                            _write_file(path, data)
+                        if image_writer is not None:
+                            image_writer.flush()
+                    except Exception as e:
+                        result['ok'] = False
+                        result['error'] = f"{type(e).__name__}: {e}"
+                if result['seconds'] is not None:
+                    result['seconds'] = round(result['seconds'] + time.perf_counter() - start, 4)
+                results.append(result)
+                if on_result:
+                    on_result(result)
+        except BaseException as e:
+            # Reported by hand_over and at the end of the run
+            writer_errors.append(e)
+
+    def hand_over(result):
+        # Queue a result for the writer, failing rather than blocking for
+        # good on a full queue when the writer has died
+        while True:
+            if not writer.is_alive():
+                raise writer_errors[0] if writer_errors else RuntimeError("The writer thread stopped")
+            try:
+                write_queue.put(result, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    reader = threading.Thread(target=read, daemon=True)
+    writer = threading.Thread(target=write, daemon=True)
+    reader.start()
+    writer.start()
+    # Workers only name images; the writer thread writes them
+    worker_images = dict(image_settings, threads=0) if image_settings else None
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(keyword_replacements, options, worker_images, topic_types,
+                                           decisions, keyref)) as executor:
+            running = {}
+            reading = True
+            while reading or running:
+                # Keep every worker busy with one document queued behind it
+                while reading and len(running) < 2 * workers:
+                    item = read_queue.get()
+                    if item is None:
+                        reading = False
+                        break
+                    docx_path, dita_path, data, error = item
+                    if error is not None:
+                        hand_over({'input': docx_path, 'output': dita_path, 'ok': False,
+                                   'error': error, 'seconds': None})
+                        continue
+                    running[executor.submit(_convert_one, docx_path, dita_path, data)] = (docx_path, dita_path)
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    docx_path, dita_path = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        result = {'input': docx_path, 'output': dita_path, 'ok': False,
+                                  'error': f"{type(e).__name__}: {e}", 'seconds': None}
+                    hand_over(result)
+    finally:
+        stop.set()
+        # Unblock the reader if it is waiting on a full queue
+        while reader.is_alive():
+            try:
+                read_queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        if writer.is_alive():
+            hand_over(None)
+        writer.join()
+        if image_writer is not None:
+            image_writer.close()
+    if writer_errors:
+        raise writer_errors[0]
+    return results
+
+
+def load_keyword_replacements(path, profile=None):
+    # Keyword replacements of a profile in a preferences file (see
+    # ditafy.preferences); none when the file does not exist
+    return PreferencesStore(path).keywords(profile)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Convert .docx files to DITA topics in bulk.")
+    parser.add_argument('inputs', nargs='+', help=".docx files, directories or glob patterns")
+    parser.add_argument('-o', '--output-dir', help="directory for .dita files (default: next to each input)")
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help="number of worker processes (default: CPU count, 1 runs in-process)")
+    parser.add_argument('-p', '--preferences', default='preferences.json',
+                        help="keyword replacements file (default: preferences.json)")
+    parser.add_argument('--preferences-profile', default=DEFAULT_PROFILE, metavar='NAME',
+                        help=f"profile of the preferences file to use (default: {DEFAULT_PROFILE})")
+    parser.add_argument('--keyref', choices=KEYREF_ELEMENTS,
+                        help="treat keyword replacement values as key names: insert <ph keyref> or <keyword keyref> "
+                             "elements and write the keys used to a key definition map")
+    parser.add_argument('--keys-map', help="key definition map written with --keyref "
+                                           f"(default: {KEYS_MAP_NAME} in the output directory)")
+    parser.add_argument('--topic-type', type=parse_topic_types, default=[TASK],
+                        help=f"{', '.join(TOPIC_TYPES)}, several of them separated by commas to write one file "
+                             f"per type, or {AUTO_TOPIC} to pick one per document (default: {TASK})")
+    parser.add_argument('--split-level', type=int, choices=range(0, 10), default=0, metavar='N',
+                        help="write a topic per Heading 1 to Heading N section and a .ditamap of them (default: 0, one topic per file)")
+    parser.add_argument('--no-notes', action='store_true',
+                        help="do not convert 'Note:', 'Warning:' and similar paragraphs to notes")
+    parser.add_argument('--no-shortdesc', action='store_true', help="do not detect a short description")
+    parser.add_argument('--no-numbering', action='store_true',
+                        help="detect steps from style names only, ignoring Word list levels")
+    parser.add_argument('--tables', choices=TABLE_FORMATS, default=AUTO,
+                        help="table output: simpletable unless cells span (auto, the default), always table, or always simpletable")
+    parser.add_argument('--style-roles', help="JSON file mapping style names to roles (step, substep, note, info, title, heading)")
+    parser.add_argument('--rules', help="JSON or YAML file mapping style names, text prefixes and list levels to "
+                                        "roles and note types, e.g. {\"prefixes\": {\"Caution:\": \"note type=caution\"}}")
+    parser.add_argument('--decisions', action='store_true',
+                        help="accept or reject notes and short descriptions as recorded in <name>.decisions.json "
+                             "next to each input, e.g. by the review window of the GUI")
+    parser.add_argument('--no-inline', action='store_true',
+                        help="convert text without its bold, italic, code, UI control and hyperlink markup")
+    parser.add_argument('--character-styles', help="JSON file mapping character style names to inline elements "
+                                                   f"({', '.join(INLINE_ELEMENTS)})")
+    parser.add_argument('--streaming', action='store_true',
+                        help="read documents incrementally to keep memory flat on very large files")
+    parser.add_argument('--images-dir', help="extract images into this directory and reference them from the topics")
+    parser.add_argument('--image-name', default=DEFAULT_NAME_TEMPLATE,
+                        help="image file name template using {hash}, {task_id}, {index} and {ext} "
+                             f"(default: {DEFAULT_NAME_TEMPLATE}, which also dedupes across workers)")
+    parser.add_argument('--image-format', help="convert images to this format (e.g. png); by default the original bytes are kept")
+    parser.add_argument('--image-threads', type=int, default=4, help="image writer threads per worker (default: 4)")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="overlap reading inputs and writing outputs with the conversions")
+    parser.add_argument('--prefetch', type=int, default=8,
+                        help="with --pipeline, how many inputs to read ahead and outputs to queue for writing (default: 8)")
+    parser.add_argument('--force', action='store_true', help="convert every input even if its output is up to date")
+    parser.add_argument('--manifest', help=f"incremental build manifest (default: {MANIFEST_NAME} in the output directory)")
+    parser.add_argument('--no-cache', action='store_true', help="do not read or write the build manifest")
+    parser.add_argument('--profile', nargs='?', const='-', default=profile_target_from_env(), metavar='FILE',
+                        help="record time and memory of each conversion stage per document as JSON lines in FILE "
+                             f"(default: stderr); {ENV_VAR}=FILE does the same")
+    parser.add_argument('--profile-times-only', action='store_true',
+                        help="profile without tracing memory, which slows conversions down")
+    parser.add_argument('--report', help="write a JSON summary report to this file")
+    parser.add_argument('-q', '--quiet', action='store_true', help="only print failures and the summary")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.split_level and len(args.topic_type) > 1:
+        parser.error("--split-level takes a single --topic-type")
+    if args.style_roles and args.rules:
+        parser.error("--style-roles cannot be combined with --rules; use the styles section of the rules file")
+    rules = {}
+    if args.rules:
+        try:
+            rules = load_rules(args.rules)
+        except (OSError, ValueError) as e:
+            parser.error(f"{args.rules}: {e}")
+    if args.style_roles:
+        rules['style_roles'] = load_style_roles(args.style_roles)
+
+    if args.images_dir and not any(field in args.image_name for field in ('{hash', '{task_id')):
+        # Workers cannot see each other's names, so documents must not share them
+        parser.error("--image-name must contain {hash} or {task_id}")
+
+    inputs = collect_inputs(args.inputs)
+    if not inputs:
+        print("No .docx files found.", file=sys.stderr)
+        return 2
+
+    extension = '.ditamap' if args.split_level else '.dita'
+    jobs = [(docx_path, dita_path_for(docx_path, relative, args.output_dir, extension))
+            for docx_path, relative in inputs]
+    targets = {}
+    for docx_path, dita_path in jobs:
+        other = targets.setdefault(os.path.normcase(os.path.abspath(dita_path)), docx_path)
+        if other != docx_path:
+            print(f"{other} and {docx_path} would both be written to {dita_path}.", file=sys.stderr)
+            return 2
+    if args.images_dir and '{hash' not in args.image_name:
+        task_ids = {}
+        for docx_path, dita_path in jobs:
+            other = task_ids.setdefault(task_id_from_path(docx_path), docx_path)
+            if other != docx_path:
+                print(f"{other} and {docx_path} have the same task ID, so --image-name needs {{hash}}.",
+                      file=sys.stderr)
+                return 2
+    options = ConversionOptions(
+        check_for_notes=not args.no_notes,
+        detect_shortdesc=not args.no_shortdesc,
+        streaming=args.streaming,
+        detect_numbering=not args.no_numbering,
+        table_format=args.tables,
+        topic_type=args.topic_type[0],
+        split_level=args.split_level,
+        inline_formatting=not args.no_inline,
+        character_styles=load_character_styles(args.character_styles) if args.character_styles else None,
+        profiler=StageProfiler(trace_memory=not args.profile_times_only) if args.profile else None,
+        **rules,
+    )
+    profile_writer = JsonLinesWriter(args.profile) if args.profile else None
+
+    def on_result(result):
+        if profile_writer is not None and result.get('profile'):
+            profile_writer.write(result['profile'])
+        if not result['ok']:
+            print(f"FAILED {result['input']}: {result['error']}", file=sys.stderr)
+        elif not args.quiet:
+            print(f"{result['input']} -> {result['output']}")
+
+    image_settings = None
+    if args.images_dir:
+        image_settings = {
+            'output_dir': os.path.abspath(args.images_dir),
+            'name_template': args.image_name,
+            'image_format': args.image_format,
+            'threads': args.image_threads,
+        }
+        options.include_images = True
+
+    try:
+        keyword_replacements = load_keyword_replacements(args.preferences, args.preferences_profile)
+        # Compiled once here, which also checks key names in keyref mode;
+        # worker processes load it from the matcher cache
+        keyword_matcher = compiled_matcher(keyword_replacements, args.keyref)
+    except (KeyError, ValueError) as e:
+        parser.error(f"{args.preferences}: {e.args[0]}")
+
+    def extra_inputs_for(docx_path):
+        # Inputs besides the .docx that change its output
+        return [decisions_path_for(docx_path)] if args.decisions else []
+
+    start = time.perf_counter()
+    manifest = None
+    skipped = []
+    if not args.no_cache:
+        manifest_path = args.manifest or os.path.join(args.output_dir or '.', MANIFEST_NAME)
+        manifest = BuildManifest(manifest_path, build_fingerprint(keyword_replacements, options, image_settings,
+                                                                     args.keyref))
+        if not args.force:
+            stale = []
+            for docx_path, dita_path in jobs:
+                outputs = list(topic_paths_for(dita_path, args.topic_type).values()) if len(args.topic_type) > 1 else None
+                try:
+                    current = manifest.is_current(docx_path, dita_path, outputs, extra_inputs_for(docx_path))
+                except OSError:
+                    current = False
+                (skipped if current else stale).append((docx_path, dita_path))
+            jobs = stale
+
+    if args.pipeline:
+        results = convert_pipelined(jobs, keyword_replacements, options, workers=args.workers, on_result=on_result,
+                                    image_settings=image_settings, topic_types=args.topic_type,
+                                    prefetch=max(args.prefetch, 1), decisions=args.decisions, keyref=args.keyref)
+    else:
+        results = convert_batch(jobs, keyword_replacements, options, workers=args.workers,
+                                on_result=on_result, image_settings=image_settings, topic_types=args.topic_type,
+                                decisions=args.decisions, keyref=args.keyref)
+    elapsed = time.perf_counter() - start
+
+    if manifest is not None:
+        for result in results:
+            if result['ok']:
+                manifest.record(result['input'], result['output'], extra_inputs_for(result['input']),
+                                result.get('keys'), result.get('outputs'))
+            else:
+                manifest.forget(result['output'])
+        manifest.save()
+
+    if args.keyref:
+        # One map defines the keys of every output, including those that
+        # were up to date; their keys come from the manifest
+        keys = {key for result in results if result['ok'] for key in result.get('keys', ())}
+        if manifest is not None:
+            keys.update(key for _, dita_path in skipped for key in manifest.keys(dita_path))
+        keys_map_path = args.keys_map or os.path.join(args.output_dir or '.', KEYS_MAP_NAME)
+        os.makedirs(os.path.dirname(os.path.abspath(keys_map_path)), exist_ok=True)
+        write_dita(build_keys_map(keyword_matcher.key_texts, keys), keys_map_path)
+
+    failures = [result for result in results if not result['ok']]
+    print(f"Converted {len(results) - len(failures)} of {len(results)} files "
+          f"in {elapsed:.1f}s, {len(skipped)} up to date, {len(failures)} failed.")
+
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump({
+                'total': len(results),
+                'succeeded': len(results) - len(failures),
+                'failed': len(failures),
+                'skipped': len(skipped),
+                'seconds': round(elapsed, 3),
+                'results': sorted(results, key=lambda result: result['input']),
+            }, f, indent=2)
+
+    if profile_writer is not None:
+        profile_writer.close()
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
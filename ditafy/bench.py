@@ -0,0 +1,352 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import struct
+import sys
+import tempfile
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import replace
+
+from ditafy import CONVERTER_VERSION
+from ditafy.converter import ConversionOptions, docx_to_dita_task
+from ditafy.images import ImageWriter
+from ditafy.keywords import KeywordMatcher
+from ditafy.profiling import StageProfiler
+
+try:
+    import resource
+except ImportError:
+    # Windows: peak memory is not recorded
+    resource = None
+
+# Stages of one conversion, in order
+STAGES = ('load', 'transform', 'replacement', 'pretty_print', 'write')
+
+# Synthetic corpora. Each document has the given number of body paragraphs,
+# list items nested up to list_depth levels, images spread through the
+# text and a keyword table of the given size whose terms occur in it.
+CASES = {
+    'small': {'documents': 20, 'paragraphs': 200, 'list_depth': 2, 'images': 0, 'keywords': 50},
+    'lists': {'documents': 5, 'paragraphs': 5000, 'list_depth': 6, 'images': 0, 'keywords': 100},
+    'images': {'documents': 5, 'paragraphs': 1000, 'list_depth': 2, 'images': 40, 'keywords': 100},
+    'keywords': {'documents': 5, 'paragraphs': 5000, 'list_depth': 2, 'images': 0, 'keywords': 5000},
+    'large': {'documents': 1, 'paragraphs': 100000, 'list_depth': 3, 'images': 10, 'keywords': 500},
+}
+DEFAULT_CASES = ('small', 'lists', 'images', 'keywords')
+
+DEFAULT_BASELINE = 'bench-baseline.json'
+# Stages faster than this in the baseline are too noisy to compare
+MIN_COMPARED_SECONDS = 0.05
+
+_W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+_R = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+_RELS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_OFFICE_DOCUMENT = _R + '/officeDocument'
+
+_CONTENT_TYPES = f'''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+<Default Extension="xml" ContentType="application/xml"/>
+<Default Extension="png" ContentType="image/png"/>
+<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>
+<Override PartName="/word/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.styles+xml"/>
+<Override PartName="/word/numbering.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.numbering+xml"/>
+</Types>'''
+
+_PACKAGE_RELS = f'''<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="{_RELS}"><Relationship Id="rId1" Type="{_OFFICE_DOCUMENT}" Target="word/document.xml"/></Relationships>'''
+
+
+def _style(style_id, name, num_id=None, based_on=None, default=False):
+    default_attr = ' w:default="1"' if default else ''
+    based_on = f'<w:basedOn w:val="{based_on}"/>' if based_on else ''
+    numbering = f'<w:pPr><w:numPr><w:numId w:val="{num_id}"/></w:numPr></w:pPr>' if num_id else ''
+    return (f'<w:style w:type="paragraph"{default_attr} w:styleId="{style_id}">'
+            f'<w:name w:val="{name}"/>{based_on}{numbering}</w:style>')
+
+
+_STYLES = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:styles xmlns:w="{_W}">'
+           + _style('Normal', 'Normal', default=True)
+           + _style('Title', 'Title', based_on='Normal')
+           + _style('Heading1', 'heading 1', based_on='Normal')
+           + _style('ListNumber', 'List Number', num_id=1, based_on='Normal')
+           + _style('ListBullet', 'List Bullet', num_id=2, based_on='Normal')
+           + '</w:styles>')
+
+
+def _abstract_num(abstract_id, num_format):
+    levels = ''.join(f'<w:lvl w:ilvl="{ilvl}"><w:start w:val="1"/><w:numFmt w:val="{num_format}"/></w:lvl>'
+                     for ilvl in range(9))
+    return f'<w:abstractNum w:abstractNumId="{abstract_id}">{levels}</w:abstractNum>'
+
+
+_NUMBERING = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?><w:numbering xmlns:w="{_W}">'
+              + _abstract_num(0, 'decimal') + _abstract_num(1, 'bullet')
+              + '<w:num w:numId="1"><w:abstractNumId w:val="0"/></w:num>'
+              + '<w:num w:numId="2"><w:abstractNumId w:val="1"/></w:num>'
+              + '</w:numbering>')
+
+
+def _png(seed, size=32):
+    # A small PNG, distinct for every seed
+    rows = b''.join(b'\x00' + bytes((seed + x + y) % 256 for x in range(size * 3)) for y in range(size))
+
+    def chunk(kind, data):
+        return (struct.pack('>I', len(data)) + kind + data
+                + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff))
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', struct.pack('>IIBBBBB', size, size, 8, 2, 0, 0, 0))
+            + chunk(b'tEXt', b'Comment\x00' + str(seed).encode()) + chunk(b'IDAT', zlib.compress(rows))
+            + chunk(b'IEND', b''))
+
+
+def synthetic_keywords(count):
+    # Keyword table in the preferences.json format, half of it plain text
+    # replacements and half markup
+    return {f'Widget{i}': (f'<keyword keyref="widget{i}"/>' if i % 2 else f'Widget {i}')
+            for i in range(count)}
+
+
+def _paragraph(text, style=None, ilvl=None, num_id=None, image_rel_id=None):
+    ppr = ''
+    if style or num_id:
+        numbering = f'<w:numPr><w:ilvl w:val="{ilvl}"/><w:numId w:val="{num_id}"/></w:numPr>' if num_id else ''
+        style = f'<w:pStyle w:val="{style}"/>' if style else ''
+        ppr = f'<w:pPr>{style}{numbering}</w:pPr>'
+    image = ''
+    if image_rel_id:
+        image = (f'<w:r><w:drawing><wp:inline><a:graphic><a:graphicData><pic:pic><pic:blipFill>'
+                 f'<a:blip r:embed="{image_rel_id}"/></pic:blipFill></pic:pic></a:graphicData></a:graphic>'
+                 f'</wp:inline></w:drawing></w:r>')
+    return f'<w:p>{ppr}<w:r><w:t xml:space="preserve">{text}</w:t></w:r>{image}</w:p>'
+
+
+def generate_docx(path, paragraphs=1000, list_depth=2, images=0, keywords=0, seed=0):
+    """Write a synthetic .docx for benchmarking.
+
+    The body mixes numbered list items down to list_depth levels, bullets,
+    plain paragraphs and notes, with images anchored at evenly spaced
+    paragraphs and terms from synthetic_keywords(keywords) in the text.
+    """
+    body = [_paragraph(f'Synthetic document {seed}', style='Title'),
+            _paragraph('A generated document for measuring conversion speed.')]
+    image_every = paragraphs // images if images else 0
+    relationships = [
+        f'<Relationship Id="rId1" Type="{_R}/styles" Target="styles.xml"/>',
+        f'<Relationship Id="rId2" Type="{_R}/numbering" Target="numbering.xml"/>',
+    ]
+    media = {}
+    for i in range(paragraphs):
+        term = f'Widget{(i * 7919 + seed) % keywords}' if keywords else 'widget'
+        text = f'Paragraph {i} configures the {term} before the next step.'
+        image_rel_id = None
+        if image_every and i % image_every == 0 and len(media) < images:
+            image_rel_id = f'rId{100 + len(media)}'
+            name = f'image{len(media) + 1}.png'
+            media[name] = _png(seed * 1000 + len(media))
+            relationships.append(f'<Relationship Id="{image_rel_id}" Type="{_R}/image" Target="media/{name}"/>')
+        kind = i % 10
+        if kind < 6:
+            body.append(_paragraph(text, 'ListNumber', i % list_depth if list_depth else 0, 1, image_rel_id))
+        elif kind == 6:
+            body.append(_paragraph(text, 'ListBullet', 0, 2, image_rel_id))
+        elif kind == 7:
+            body.append(_paragraph(f'Note: {text}', image_rel_id=image_rel_id))
+        else:
+            body.append(_paragraph(text, image_rel_id=image_rel_id))
+
+    document = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                f'<w:document xmlns:w="{_W}" xmlns:r="{_R}" '
+                f'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+                f'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+                f'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+                f'<w:body>{"".join(body)}<w:sectPr/></w:body></w:document>')
+    document_rels = (f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                     f'<Relationships xmlns="{_RELS}">{"".join(relationships)}</Relationships>')
+
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', _CONTENT_TYPES)
+        z.writestr('_rels/.rels', _PACKAGE_RELS)
+        z.writestr('word/document.xml', document)
+        z.writestr('word/_rels/document.xml.rels', document_rels)
+        z.writestr('word/styles.xml', _STYLES)
+        z.writestr('word/numbering.xml', _NUMBERING)
+        for name, blob in media.items():
+            z.writestr(f'word/media/{name}', blob, zipfile.ZIP_STORED)
+
+
+def generate_corpus(directory, case):
+    # Write the documents of one CASES entry; returns their paths
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for seed in range(case['documents']):
+        path = os.path.join(directory, f'doc{seed:03}.docx')
+        generate_docx(path, case['paragraphs'], case['list_depth'], case['images'], case['keywords'], seed)
+        paths.append(path)
+    return paths
+
+
+def time_stages(docx_path, dita_path, options):
+    # Seconds spent in each of STAGES converting one document
+    profiler = StageProfiler(trace_memory=False)
+    with profiler.document(docx_path) as record:
+        docx_to_dita_task(docx_path, dita_path, 'benchmark', replace(options, profiler=profiler))
+    return {stage: record['stages'].get(stage, {}).get('wall', 0.0) for stage in STAGES}
+
+
+def _peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10), 1)
+
+
+def run_case(name, work_dir, repeat=3, streaming=False):
+    """Generate one corpus and time its conversion.
+
+    Each stage reports the fastest of repeat runs over the whole corpus.
+    Meant to run in a fresh process so the peak RSS belongs to this case.
+    """
+    case = CASES[name]
+    corpus_dir = os.path.join(work_dir, name)
+    paths = generate_corpus(corpus_dir, case)
+    out_dir = os.path.join(work_dir, name + '-out')
+    os.makedirs(out_dir, exist_ok=True)
+
+    keyword_matcher = KeywordMatcher(synthetic_keywords(case['keywords']))
+    images = ImageWriter(os.path.join(out_dir, 'images'))
+    best = None
+    try:
+        for _ in range(repeat):
+            totals = dict.fromkeys(STAGES, 0.0)
+            for path in paths:
+                dita_path = os.path.join(out_dir, os.path.basename(path)[:-5] + '.dita')
+                options = ConversionOptions(streaming=streaming, include_images=case['images'] > 0,
+                                            keyword_matcher=keyword_matcher,
+                                            save_image=images.saver('benchmark', dita_path))
+                for stage, seconds in time_stages(path, dita_path, options).items():
+                    totals[stage] += seconds
+                images.flush()
+            if best is None:
+                best = totals
+            else:
+                best = {stage: min(best[stage], totals[stage]) for stage in STAGES}
+    finally:
+        images.close()
+
+    total = sum(best.values())
+    paragraphs = case['documents'] * case['paragraphs']
+    size = sum(os.path.getsize(path) for path in paths)
+    return {
+        'case': case,
+        'stages': {stage: round(seconds, 4) for stage, seconds in best.items()},
+        'total': round(total, 4),
+        'documents_per_second': round(case['documents'] / total, 2),
+        'paragraphs_per_second': round(paragraphs / total),
+        'mb_per_second': round(size / (1 << 20) / total, 2),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def run_benchmarks(names, work_dir, repeat=3, streaming=False, on_case=None):
+    results = {}
+    # spawn gives every case a fresh interpreter and a clean RSS peak
+    context = multiprocessing.get_context('spawn')
+    for name in names:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[name] = executor.submit(run_case, name, work_dir, repeat, streaming).result()
+        if on_case:
+            on_case(name, results[name])
+    return {
+        'converter_version': CONVERTER_VERSION,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'streaming': streaming,
+        'cases': results,
+    }
+
+
+def compare(baseline, current, threshold=0.2):
+    # Regressions of current against baseline as readable messages: any
+    # stage, the total or the peak RSS more than threshold (a fraction) worse.
+    regressions = []
+    for name, result in current['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if base is None:
+            continue
+        measures = [(f'{stage} time', base['stages'].get(stage), result['stages'][stage], 's')
+                    for stage in STAGES]
+        measures.append(('total time', base['total'], result['total'], 's'))
+        measures.append(('peak RSS', base.get('peak_rss_mb'), result['peak_rss_mb'], ' MB'))
+        for label, before, after, unit in measures:
+            if before is None or after is None:
+                continue
+            if unit == 's' and before < MIN_COMPARED_SECONDS:
+                continue
+            if after > before * (1 + threshold):
+                regressions.append(f"{name}: {label} {before}{unit} -> {after}{unit} "
+                                   f"(+{(after / before - 1) * 100:.0f}%)")
+    return regressions
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark DITAfy conversions on synthetic .docx corpora.")
+    parser.add_argument('--cases', default=','.join(DEFAULT_CASES),
+                        help=f"comma-separated cases to run, from {', '.join(CASES)} (default: {','.join(DEFAULT_CASES)})")
+    parser.add_argument('--repeat', type=int, default=3, help="runs per case; each stage keeps its fastest (default: 3)")
+    parser.add_argument('--streaming', action='store_true', help="benchmark the streaming reader")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE,
+                        help=f"baseline JSON to compare against (default: {DEFAULT_BASELINE})")
+    parser.add_argument('--save-baseline', action='store_true', help="write the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="fail when a measure is this fraction worse than the baseline (default: 0.2)")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    parser.add_argument('--work-dir', help="where to generate corpora (default: a temporary directory)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    names = [name.strip() for name in args.cases.split(',') if name.strip()]
+    unknown = [name for name in names if name not in CASES]
+    if unknown or not names:
+        parser.error(f"unknown case {', '.join(unknown)}; expected {', '.join(CASES)}")
+
+    def on_case(name, result):
+        stages = ', '.join(f"{stage} {result['stages'][stage]:.3f}s" for stage in STAGES)
+        print(f"{name}: {result['total']:.3f}s ({stages}), {result['paragraphs_per_second']} paragraphs/s, "
+              f"peak RSS {result['peak_rss_mb']} MB")
+
+    if args.work_dir:
+        results = run_benchmarks(names, args.work_dir, args.repeat, args.streaming, on_case)
+    else:
+        with tempfile.TemporaryDirectory(prefix='ditafy-bench-') as work_dir:
+            results = run_benchmarks(names, work_dir, args.repeat, args.streaming, on_case)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}.")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to create one.")
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(baseline, results, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}", file=sys.stderr)
+    if regressions:
+        return 1
+    print(f"No regressions beyond {args.threshold:.0%} against {args.baseline}.")
+    return 0
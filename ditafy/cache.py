@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+
+from ditafy import CONVERTER_VERSION
+
+MANIFEST_NAME = '.ditafy-manifest.json'
+
+# ConversionOptions fields that change the output. Callbacks and the
+# compiled matcher are covered by the keyword hash instead.
+FINGERPRINT_FIELDS = ('check_for_notes', 'detect_shortdesc', 'include_images', 'style_roles', 'note_prefixes',
+                      'numbering_roles', 'inline_formatting', 'character_styles', 'detect_numbering', 'table_format',
+                      'topic_type', 'split_level')
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def keywords_hash(keyword_replacements):
+    data = json.dumps(keyword_replacements, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+def build_fingerprint(keyword_replacements, options, image_settings=None, keyref=None):
+    # Everything other than the source file that affects a conversion.
+    image_settings = dict(image_settings or {})
+    image_settings.pop('threads', None)
+    return {
+        'version': CONVERTER_VERSION,
+        'keywords': keywords_hash(keyword_replacements),
+        'keyref': keyref,
+        'options': {name: getattr(options, name) for name in FINGERPRINT_FIELDS},
+        'images': image_settings,
+    }
+
+
+class BuildManifest:
+    """Records which inputs produced which outputs, so unchanged files can be skipped.
+
+    Entries are keyed by output path and hold the source content hash plus
+    its size and mtime. The hash is only recomputed when size or mtime moved,
+    so checking an unchanged tree costs one stat per file.
+    """
+
+    def __init__(self, path, fingerprint):
+        self.path = path
+        self.fingerprint = fingerprint
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                data = {}
+            # A different converter version, keyword table or option set
+            # invalidates every entry.
+            if data.get('fingerprint') == fingerprint:
+                self.entries = data.get('entries', {})
+        self._pending = {}
+
+    def _source_state(self, docx_path, entry, extra_inputs=()):
+        stat = os.stat(docx_path)
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime_ns:
+            digest = entry['hash']
+        else:
+            digest = file_hash(docx_path)
+        state = {'source': os.path.abspath(docx_path), 'size': stat.st_size,
+                 'mtime': stat.st_mtime_ns, 'hash': digest}
+        if extra_inputs:
+            # Small per-input files, such as review decisions, are always
+            # hashed; a missing one is recorded as None
+            state['extra'] = {os.path.abspath(path): file_hash(path) if os.path.exists(path) else None
+                              for path in extra_inputs}
+        return state
+
+    def is_current(self, docx_path, dita_path, outputs=None, extra_inputs=()):
+        # True when dita_path (or every path in outputs, for inputs written
+        # to several files) and every output recorded for it, such as split
+        # topics, exist and were built from identical input, including the
+        # files in extra_inputs.
+        key = os.path.abspath(dita_path)
+        entry = self.entries.get(key)
+        state = self._source_state(docx_path, entry, extra_inputs)
+        self._pending[key] = state
+        if entry is None:
+            return False
+        if not all(os.path.exists(path) for path in list(outputs or [dita_path]) + entry.get('outputs', [])):
+            return False
+        if (entry['hash'] != state['hash'] or entry['source'] != state['source']
+                or entry.get('extra') != state.get('extra')):
+            return False
+        # Same content with a new mtime (e.g. a fresh checkout): remember the
+        # new mtime so the next run does not hash the file again.
+        state = self._pending.pop(key)
+        for name in ('keys', 'outputs'):
+            if name in entry:
+                state[name] = entry[name]
+        self.entries[key] = state
+        return True
+
+    def record(self, docx_path, dita_path, extra_inputs=(), keys=None, outputs=None):
+        # keys, the DITA keys the output references, are kept for keys().
+        # outputs are all the files written, which is_current requires.
+        key = os.path.abspath(dita_path)
+        state = self._pending.pop(key, None) or self._source_state(docx_path, None, extra_inputs)
+        if keys is not None:
+            state['keys'] = sorted(keys)
+        if outputs is not None:
+            state['outputs'] = sorted(os.path.abspath(path) for path in outputs)
+        self.entries[key] = state
+
+    def keys(self, dita_path):
+        return self.entries.get(os.path.abspath(dita_path), {}).get('keys', [])
+
+    def forget(self, dita_path):
+        self.entries.pop(os.path.abspath(dita_path), None)
+
+    def save(self):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'fingerprint': self.fingerprint, 'entries': self.entries}, f)
+        os.replace(tmp_path, self.path)
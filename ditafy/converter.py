@@ -0,0 +1,572 @@
+import itertools
+import re
+import xml.etree.ElementTree as ET
+from contextlib import nullcontext
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from ditafy.inline import InlineFormatter
+from ditafy.keywords import KeywordMatcher
+from ditafy.numbering import BULLET, build_style_numbering, list_level
+from ditafy.reader import Table, open_source
+from ditafy.styles import HEADING, INFO, NOTE, STEP, SUBSTEP, TITLE, RuleTable, build_role_table, parse_target
+from ditafy.tables import AUTO, build_table
+from ditafy.writer import indent_tree, iter_dita, write_dita
+
+TASK = 'task'
+CONCEPT = 'concept'
+REFERENCE = 'reference'
+TOPIC_TYPES = (TASK, CONCEPT, REFERENCE)
+# ConversionOptions.topic_type value that picks one of TOPIC_TYPES per document
+AUTO_TOPIC = 'auto'
+
+
+@dataclass
+class ConversionOptions:
+    """Settings for one conversion, shared by the GUI, CLI and web front-ends.
+
+    The callbacks let a front-end take part in decisions without the engine
+    knowing about it. Left as None, every detected shortdesc and note is
+    accepted and images are skipped, which is what headless runs want.
+    """
+    check_for_notes: bool = True
+    detect_shortdesc: bool = True
+    include_images: bool = False
+    # Read word/document.xml incrementally instead of loading it with python-docx
+    streaming: bool = False
+    # Style name -> role or target such as 'note type=warning' (see
+    # ditafy.styles); None uses DEFAULT_STYLE_ROLES
+    style_roles: Optional[Dict[str, str]] = None
+    # Text prefix -> note target; None uses DEFAULT_NOTE_PREFIXES
+    note_prefixes: Optional[Dict[str, str]] = None
+    # Word list level ('1'-'9') -> target; None uses DEFAULT_NUMBERING_ROLES
+    numbering_roles: Optional[Dict[str, str]] = None
+    # Keep bold, italic, code, UI control and hyperlink runs as inline elements
+    inline_formatting: bool = True
+    # Character style name -> inline element (see ditafy.inline); None uses
+    # DEFAULT_CHARACTER_STYLES
+    character_styles: Optional[Dict[str, str]] = None
+    # Nest steps by each paragraph's list level (w:numPr), not only by style
+    detect_numbering: bool = True
+    # 'auto' (simpletable unless cells span), 'table' or 'simpletable'
+    table_format: str = AUTO
+    # One of TOPIC_TYPES, or AUTO_TOPIC to classify each document
+    topic_type: str = TASK
+    # Split into a topic per heading down to this level plus a .ditamap
+    # (see ditafy.splitter); 0 converts the document to a single topic
+    split_level: int = 0
+    keyword_matcher: Optional[KeywordMatcher] = None
+    # confirm_shortdesc(text) -> bool
+    confirm_shortdesc: Optional[Callable[[str], bool]] = None
+    # confirm_note(text) -> bool
+    confirm_note: Optional[Callable[[str], bool]] = None
+    # save_image(blob) -> href for the <image> element, or None to skip it
+    save_image: Optional[Callable[[bytes], Optional[str]]] = None
+    # ditafy.profiling.StageProfiler recording each stage, or None
+    profiler: Optional[object] = None
+    # progress(kind, count) after each 'block' built and each 'image' saved;
+    # it may raise ConversionCancelled to stop the conversion
+    progress: Optional[Callable[[str, int], None]] = None
+
+
+class ConversionCancelled(Exception):
+    pass
+
+
+def profile_stage(options, name):
+    # Context manager timing one stage of a conversion, when profiling
+    if options.profiler is None:
+        return nullcontext()
+    return options.profiler.stage(name)
+
+
+def dita_id(text):
+    # Turn text into a valid DITA id, e.g. "02 Install Pump" becomes
+    # "_02-Install-Pump" since ids cannot start with a digit.
+    topic_id = re.sub(r'[^A-Za-z0-9_.-]+', '-', text).strip('-.')
+    if not re.match(r'[A-Za-z_]', topic_id):
+        topic_id = '_' + topic_id
+    return topic_id
+
+
+class ParsedDocument:
+    """A source read once into memory, so several topics can be built from it.
+
+    Offers the same interface as the sources in ditafy.reader; table rows
+    are kept as lists so they can be walked more than once. blocks, when
+    given, replaces the source's own blocks, e.g. with one section of it.
+    """
+
+    def __init__(self, source, blocks=None):
+        self.styles = source.styles
+        self.numbering = source.numbering
+        self.image_blob = source.image_blob
+        self._blocks = [Table(list(block.rows)) if isinstance(block, Table) else block
+                        for block in (source.blocks() if blocks is None else blocks)]
+
+    def blocks(self):
+        return iter(self._blocks)
+
+    def __len__(self):
+        return len(self._blocks)
+
+
+# Target of paragraphs whose style has no role
+_INFO = parse_target(INFO)
+
+
+class DocumentContext:
+    """Per-document state shared by every topic built from one source.
+
+    Holds the style role, rule and numbering tables, and remembers saved
+    images and the answers of the confirmation callbacks, so building a
+    second topic type from the same document neither saves images again
+    nor asks the same question twice.
+    """
+
+    def __init__(self, source, options):
+        self.source = source
+        self.options = options
+        self.roles = {style_id: parse_target(role)
+                      for style_id, role in build_role_table(source.styles, options.style_roles).items()}
+        self.rules = RuleTable(options.note_prefixes, options.numbering_roles)
+        self.style_numbering = build_style_numbering(source.styles) if options.detect_numbering else None
+        self.save_images = options.include_images and options.save_image is not None
+        self.inline = InlineFormatter(source.styles, options.character_styles) if options.inline_formatting else None
+        # Image hrefs by relationship id, so a picture used twice is saved once
+        self.image_hrefs = {}
+        self.note_answers = {}
+        self.shortdesc_answers = {}
+        self.progress_counts = {}
+
+    def role(self, para):
+        return self.roles.get(para.style_id, _INFO).role
+
+    def list_level(self, para, role):
+        # (ilvl, numFmt) for list items, None otherwise
+        if self.style_numbering is None or role == TITLE or role == HEADING:
+            return None
+        return list_level(para, self.style_numbering, self.source.numbering)
+
+    def advance(self, kind):
+        if self.options.progress is not None:
+            self.progress_counts[kind] = self.progress_counts.get(kind, 0) + 1
+            self.options.progress(kind, self.progress_counts[kind])
+
+    def image_href(self, rel_id):
+        if rel_id not in self.image_hrefs:
+            blob = self.source.image_blob(rel_id)
+            self.image_hrefs[rel_id] = self.options.save_image(blob) if blob is not None else None
+            self.advance('image')
+        return self.image_hrefs[rel_id]
+
+    def image_rel_ids(self, para):
+        return para.image_rel_ids if self.save_images else ()
+
+    def classify(self, para):
+        # (role, list level, note) of a paragraph, each found by a dict
+        # lookup. A numbered paragraph with a step, substep or info style
+        # takes the target of its list level when the rules give one. note
+        # is (text, attributes) from a prefix rule or the paragraph's
+        # target, or None when it is not a note.
+        target = self.roles.get(para.style_id, _INFO)
+        level = self.list_level(para, target.role)
+        if level is not None and target.role in (STEP, SUBSTEP, INFO) and level[0] in self.rules.levels:
+            target = self.rules.levels[level[0]]
+            if target.role not in (STEP, SUBSTEP):
+                level = None
+
+        note = None
+        if self.options.check_for_notes:
+            para_text = para.text.strip()
+            prefixed = self.rules.prefix(para_text)
+            if prefixed is not None:
+                note = prefixed[1], dict(prefixed[0].attrib)
+            elif target.role == NOTE:
+                note = para_text, dict(target.attrib)
+        return target.role, level, note
+
+    def confirm_note(self, text):
+        if self.options.confirm_note is None:
+            return True
+        if text not in self.note_answers:
+            self.note_answers[text] = self.options.confirm_note(text)
+        return self.note_answers[text]
+
+    def confirm_shortdesc(self, text):
+        if self.options.confirm_shortdesc is None:
+            return True
+        if text not in self.shortdesc_answers:
+            self.shortdesc_answers[text] = self.options.confirm_shortdesc(text)
+        return self.shortdesc_answers[text]
+
+    def set_text(self, element, para, text):
+        # Set element's text to text, taken from para, with its formatting
+        if self.inline is not None and para.runs:
+            self.inline.fill(element, para.runs, text)
+        else:
+            element.text = text
+
+    def is_list_item(self, para):
+        role, level, _ = self.classify(para)
+        return role in (STEP, SUBSTEP) or level is not None
+
+
+def _front_matter(root, blocks, context):
+    # Add <title> and, when detected and confirmed, <shortdesc> to root and
+    # return the remaining blocks.
+
+    first = next(blocks, None)
+    if isinstance(first, Table):
+        blocks = itertools.chain([first], blocks)
+        first = None
+    elif first is not None:
+        context.advance('block')
+    title = ET.SubElement(root, 'title')
+    if first is not None:
+        context.set_text(title, first, first.text)
+    else:
+        title.text = ''
+
+    second = next(blocks, None)
+    if second is not None:
+        blocks = itertools.chain([second], blocks)
+    if (second is not None and not isinstance(second, Table) and context.options.detect_shortdesc
+            and not context.is_list_item(second)):
+        candidate = second.text.strip()
+        if context.confirm_shortdesc(candidate):
+            shortdesc = ET.SubElement(root, 'shortdesc')
+            context.set_text(shortdesc, second, candidate)
+            next(blocks)
+            context.advance('block')
+    return blocks
+
+
+class _NestedLists:
+    # Open <ol>/<ul> lists as (depth, list element, last <li>), outermost
+    # first. Items deeper than the innermost list nest inside its last <li>.
+
+    def __init__(self):
+        self.stack = []
+
+    def reset(self):
+        self.stack = []
+
+    def add(self, depth, tag, new_parent):
+        # Add an empty <li> and return it. new_parent() returns the element
+        # to hold a new outermost list.
+        stack = self.stack
+        while stack and (stack[-1][0] > depth or stack[-1][0] == depth and stack[-1][1].tag != tag):
+            stack.pop()
+        if not stack or stack[-1][0] < depth:
+            parent = stack[-1][2] if stack else new_parent()
+            stack.append((depth, ET.SubElement(parent, tag), None))
+        depth, list_tag, _ = stack[-1]
+        item = ET.SubElement(list_tag, 'li')
+        stack[-1] = (depth, list_tag, item)
+        return item
+
+
+class _StepList:
+    # Tracks where the next list item goes: a <step> at depth 0, a
+    # <substep> at depth 1, and nested <ol>/<ul> items for deeper levels
+    # and for bullets, inside the step or substep they belong to.
+
+    def __init__(self, steps):
+        self.steps = steps
+        self.step = None
+        self.substeps = None
+        self.substep = None
+        self.lists = _NestedLists()
+
+    @property
+    def container(self):
+        return self.step if self.step is not None else self.steps
+
+    def add_info(self, in_substep=False):
+        # With in_substep, an <info> in the current substep, if there is
+        # one. Otherwise one in the step, which closes the open substeps so
+        # a later substep starts new ones after it and document order is
+        # kept.
+        self.lists.reset()
+        if in_substep and self.substep is not None:
+            return ET.SubElement(self.substep, 'info')
+        self.substeps = self.substep = None
+        return ET.SubElement(self.container, 'info')
+
+    def add_item(self, depth, bullet=False):
+        # Returns the empty <cmd> or <li> for the item's text
+        if not bullet and depth == 0:
+            self.step = ET.SubElement(self.steps, 'step')
+            self.substeps = self.substep = None
+            self.lists.reset()
+            return ET.SubElement(self.step, 'cmd')
+        elif not bullet and depth == 1 and self.step is not None:
+            if self.substeps is None:
+                self.substeps = ET.SubElement(self.step, 'substeps')
+            self.substep = ET.SubElement(self.substeps, 'substep')
+            self.lists.reset()
+            return ET.SubElement(self.substep, 'cmd')
+        else:
+            owner = self.substep if self.substep is not None and depth >= 1 else self.container
+            return self.lists.add(depth, 'ul' if bullet else 'ol', lambda: ET.SubElement(owner, 'info'))
+
+
+class _TopicBody:
+    # Places body content for concepts and references. Headings open a
+    # <section>; once one is open, content goes into it. With
+    # sections_required, content before the first heading gets an
+    # untitled section too.
+
+    def __init__(self, body, sections_required=False):
+        self.body = body
+        self.section = None
+        self.sections_required = sections_required
+        self.lists = _NestedLists()
+
+    @property
+    def container(self):
+        if self.section is None and self.sections_required:
+            self.section = ET.SubElement(self.body, 'section')
+        return self.section if self.section is not None else self.body
+
+    def start_section(self):
+        # Returns the empty <title> of the new section
+        self.lists.reset()
+        self.section = ET.SubElement(self.body, 'section')
+        return ET.SubElement(self.section, 'title')
+
+    def add(self, tag, attrib=None):
+        self.lists.reset()
+        return ET.SubElement(self.container, tag, attrib or {})
+
+    def add_item(self, depth, bullet=False):
+        container = self.container
+        return self.lists.add(depth, 'ul' if bullet else 'ol', lambda: container)
+
+
+def _list_depth(level, role):
+    # Nesting depth and bullet flag of a list item. A substep style nests
+    # one level below steps even when its own list starts at level 0, as
+    # Word's List Number 2 does.
+    ilvl, level_format = level or (0, None)
+    depth = max(ilvl, 1) if role == SUBSTEP else ilvl
+    return depth, level_format == BULLET
+
+
+def build_task(source, task_id, options=None, context=None):
+    # Build a <task> element tree from an opened source (see ditafy.reader).
+    options = options or ConversionOptions()
+    context = context or DocumentContext(source, options)
+
+    root = ET.Element('task', id=task_id)
+    blocks = _front_matter(root, source.blocks(), context)
+    task_body = ET.SubElement(root, 'taskbody')
+    steps = _StepList(ET.SubElement(task_body, 'steps'))
+
+    def add_images(rel_ids):
+        # Figures stay with the step or substep they follow
+        for rel_id in rel_ids:
+            href = context.image_href(rel_id)
+            if href:
+                fig_tag = ET.SubElement(steps.add_info(in_substep=True), 'fig')
+                ET.SubElement(fig_tag, 'image', href=href)
+
+    for para in blocks:
+        context.advance('block')
+        if isinstance(para, Table):
+            build_table(para, steps.add_info(), options.table_format,
+                        context.image_href if context.save_images else None, context.inline)
+            continue
+
+        para_text = para.text.strip()
+        rel_ids = context.image_rel_ids(para)
+
+        # A paragraph that only holds pictures becomes just its figures
+        if rel_ids and not para_text:
+            add_images(rel_ids)
+            continue
+
+        role, level, note = context.classify(para)
+
+        if note is not None:
+            note_content, note_attrib = note
+            info_tag = steps.add_info()
+            if context.confirm_note(note_content):
+                context.set_text(ET.SubElement(info_tag, 'note', note_attrib), para, note_content)
+            else:
+                context.set_text(info_tag, para, note_content)
+        elif level is not None or role in (STEP, SUBSTEP):
+            depth, bullet = _list_depth(level, role)
+            context.set_text(steps.add_item(depth, bullet), para, para_text)
+        else:
+            context.set_text(steps.add_info(), para, para_text)
+
+        if rel_ids:
+            add_images(rel_ids)
+
+    return root
+
+
+def _build_topic_body(context, blocks, body):
+    # Shared body walk for concepts and references
+    def add_images(rel_ids):
+        for rel_id in rel_ids:
+            href = context.image_href(rel_id)
+            if href:
+                ET.SubElement(body.add('fig'), 'image', href=href)
+
+    for para in blocks:
+        context.advance('block')
+        if isinstance(para, Table):
+            build_table(para, body.container, context.options.table_format,
+                        context.image_href if context.save_images else None, context.inline)
+            body.lists.reset()
+            continue
+
+        para_text = para.text.strip()
+        rel_ids = context.image_rel_ids(para)
+
+        if rel_ids and not para_text:
+            add_images(rel_ids)
+            continue
+
+        role, level, note = context.classify(para)
+        note_content, note_attrib = note or (None, None)
+
+        if role in (HEADING, TITLE) and para_text:
+            context.set_text(body.start_section(), para, para_text)
+        elif note_content is not None and context.confirm_note(note_content):
+            context.set_text(body.add('note', note_attrib), para, note_content)
+        elif note_content is not None:
+            context.set_text(body.add('p'), para, note_content)
+        elif level is not None or role in (STEP, SUBSTEP):
+            depth, bullet = _list_depth(level, role)
+            context.set_text(body.add_item(depth, bullet), para, para_text)
+        elif para_text:
+            context.set_text(body.add('p'), para, para_text)
+
+        if rel_ids:
+            add_images(rel_ids)
+
+
+def build_concept(source, topic_id, options=None, context=None):
+    # Build a <concept>: paragraphs, lists, notes, tables and figures in
+    # <conbody>, with a <section> per heading.
+    options = options or ConversionOptions()
+    context = context or DocumentContext(source, options)
+
+    root = ET.Element('concept', id=topic_id)
+    blocks = _front_matter(root, source.blocks(), context)
+    _build_topic_body(context, blocks, _TopicBody(ET.SubElement(root, 'conbody')))
+    return root
+
+
+def build_reference(source, topic_id, options=None, context=None):
+    # Build a <reference>: all content in <section>s of <refbody>, one per
+    # heading, as the reference content model requires.
+    options = options or ConversionOptions()
+    context = context or DocumentContext(source, options)
+
+    root = ET.Element('reference', id=topic_id)
+    blocks = _front_matter(root, source.blocks(), context)
+    _build_topic_body(context, blocks, _TopicBody(ET.SubElement(root, 'refbody'), sections_required=True))
+    return root
+
+
+TOPIC_BUILDERS = {
+    TASK: build_task,
+    CONCEPT: build_concept,
+    REFERENCE: build_reference,
+}
+
+
+def classify_topic(source, context):
+    # Pick a topic type from the document's content: a procedure with at
+    # least two steps is a task, a document dominated by table rows a
+    # reference, anything else a concept. Needs a re-readable source such
+    # as ParsedDocument.
+    steps = paragraphs = table_rows = 0
+    for block in source.blocks():
+        if isinstance(block, Table):
+            table_rows += len(block.rows)
+        elif block.text.strip():
+            paragraphs += 1
+            role, level, _ = context.classify(block)
+            if role == STEP or level is not None and level[0] == 0 and level[1] != BULLET:
+                steps += 1
+    if steps >= 2:
+        return TASK
+    if table_rows and table_rows >= paragraphs:
+        return REFERENCE
+    return CONCEPT
+
+
+def build_topics(source, topic_id, topic_types, options=None, context=None):
+    # Build several topic types, each a dict entry keyed by type, from one
+    # read of the source, and apply the keyword replacements to them.
+    # AUTO_TOPIC in topic_types stands for the classified type.
+    options = options or ConversionOptions()
+    if (len(topic_types) > 1 or AUTO_TOPIC in topic_types) and not isinstance(source, ParsedDocument):
+        with profile_stage(options, 'load'):
+            source = ParsedDocument(source)
+    context = context or DocumentContext(source, options)
+
+    topics = {}
+    for topic_type in topic_types:
+        if topic_type == AUTO_TOPIC:
+            topic_type = classify_topic(source, context)
+        if topic_type not in topics:
+            with profile_stage(options, 'transform'):
+                topics[topic_type] = TOPIC_BUILDERS[topic_type](source, topic_id, options, context)
+
+    if options.keyword_matcher is not None:
+        with profile_stage(options, 'replacement'):
+            for root in topics.values():
+                options.keyword_matcher.apply(root)
+    return topics
+
+
+def convert_docx_topics(source, topic_id, topic_types, options=None):
+    # build_topics on a path or a seekable binary file object, such as an
+    # upload that was never written to disk.
+    options = options or ConversionOptions()
+    # The streaming reader parses as the topic is built, so its parsing
+    # counts toward the transform stage
+    with profile_stage(options, 'load'):
+        docx_source = open_source(source, streaming=options.streaming)
+    try:
+        return build_topics(docx_source, topic_id, topic_types, options)
+    finally:
+        docx_source.close()
+
+
+def convert_docx(source, task_id, options=None):
+    # Build the topic chosen by options.topic_type.
+    options = options or ConversionOptions()
+    topics = convert_docx_topics(source, task_id, [options.topic_type], options)
+    return next(iter(topics.values()))
+
+
+def write_topic(root, dita_path, options=None):
+    # write_dita, with pretty-printing and writing profiled as stages
+    options = options or ConversionOptions()
+    with profile_stage(options, 'pretty_print'):
+        indent_tree(root)
+    with profile_stage(options, 'write'):
+        write_dita(root, dita_path, indent=None)
+
+
+def serialize_topic(root, options=None):
+    # write_topic's output as bytes, for writing somewhere else later
+    options = options or ConversionOptions()
+    with profile_stage(options, 'pretty_print'):
+        indent_tree(root)
+    with profile_stage(options, 'write'):
+        return b''.join(iter_dita(root, indent=None))
+
+
+def docx_to_dita_task(docx_path, dita_path, task_id, options=None):
+    root = convert_docx(docx_path, task_id, options)
+    write_topic(root, dita_path, options)
+    return root
@@ -0,0 +1,212 @@
+import os
+import queue
+import threading
+import time
+import tkinter as tk
+from tkinter import messagebox, ttk
+
+from ditafy.converter import ConversionCancelled
+from ditafy.review import NOTE, save_decisions
+
+
+class ConversionPanel(tk.Frame):
+    """Progress bar, status line and Cancel button for a conversion run in the background.
+
+    start() runs a function on a worker thread so the window stays
+    responsive. The worker never touches Tk: it sends progress through
+    report() and runs dialogs through ask(), and both are passed to the main
+    loop over a queue that is polled with after(). Cancel makes the next
+    report() or check() in the worker raise ConversionCancelled.
+    """
+
+    def __init__(self, master, poll_ms=50, report_interval=0.1):
+        super().__init__(master)
+        self.poll_ms = poll_ms
+        self.report_interval = report_interval
+        self.messages = queue.Queue()
+        self.cancelled = threading.Event()
+        self.thread = None
+        self.on_done = None
+        self._last_report = 0.0
+
+        self.progress_bar = ttk.Progressbar(self, length=300, mode='determinate')
+        self.progress_bar.grid(row=0, column=0, padx=(0, 10), sticky=tk.EW)
+        self.cancel_button = tk.Button(self, text="Cancel", command=self.cancel, state=tk.DISABLED)
+        self.cancel_button.grid(row=0, column=1)
+        self.status_label = tk.Label(self, text="", anchor=tk.W)
+        self.status_label.grid(row=1, column=0, columnspan=2, sticky=tk.EW)
+        self.columnconfigure(0, weight=1)
+
+    @property
+    def busy(self):
+        return self.thread is not None
+
+    def start(self, work, on_done):
+        # Run work(panel) on a worker thread, then on_done(error, result) on
+        # the main loop; error is None when work returned normally.
+        if self.busy:
+            return
+        self.cancelled.clear()
+        self.on_done = on_done
+        self.progress_bar.config(value=0, maximum=1)
+        self.cancel_button.config(state=tk.NORMAL)
+        self.thread = threading.Thread(target=self._run, args=(work,), daemon=True)
+        self.thread.start()
+        self.after(self.poll_ms, self._poll)
+
+    def cancel(self):
+        self.cancelled.set()
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_label.config(text="Cancelling...")
+
+    def _run(self, work):
+        try:
+            result = work(self)
+        except BaseException as e:
+            self.messages.put(('done', e, None))
+        else:
+            self.messages.put(('done', None, result))
+
+    # Called from the worker thread
+
+    def check(self):
+        if self.cancelled.is_set():
+            raise ConversionCancelled()
+
+    def report(self, text, done=None, total=None):
+        # Updates are sent at most every report_interval seconds, except the
+        # last one of a run (done == total)
+        self.check()
+        now = time.monotonic()
+        if now - self._last_report < self.report_interval and (done is None or done != total):
+            return
+        self._last_report = now
+        self.messages.put(('progress', text, done, total))
+
+    def ask(self, func, *args):
+        # Call func(*args) on the main loop, e.g. a dialog, and return its result
+        self.check()
+        reply = queue.Queue(maxsize=1)
+        self.messages.put(('ask', func, args, reply))
+        error, result = reply.get()
+        if error is not None:
+            raise error
+        self.check()
+        return result
+
+    # Called on the main loop
+
+    def _poll(self):
+        while True:
+            try:
+                message = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            if message[0] == 'progress':
+                _, text, done, total = message
+                if total:
+                    self.progress_bar.config(value=done, maximum=total)
+                if not self.cancelled.is_set():
+                    self.status_label.config(text=text)
+            elif message[0] == 'ask':
+                _, func, args, reply = message
+                try:
+                    reply.put((None, func(*args)))
+                except Exception as e:
+                    reply.put((e, None))
+            else:
+                self._finish(message[1], message[2])
+                return
+        self.after(self.poll_ms, self._poll)
+
+    def _finish(self, error, result):
+        self.thread = None
+        self.cancel_button.config(state=tk.DISABLED)
+        self.status_label.config(text="Cancelled." if isinstance(error, ConversionCancelled) else "")
+        self.progress_bar.config(value=0)
+        self.on_done(error, result)
+
+
+def review_candidates(master, candidates, decisions=None, decisions_path=None):
+    """Ask about every note and short description at once, in one table.
+
+    Each row shows a candidate and whether it is kept (accepted) or turned
+    into ordinary text (rejected). Rows start from decisions, when given,
+    and are otherwise accepted. Double-click or Space toggles the selected
+    rows; the buttons accept or reject the selection or every row. With
+    decisions_path, the decisions can be saved there for later runs.
+    Returns a dict mapping each Candidate to True or False; closing the
+    window accepts the initial decisions.
+    """
+    decisions = {candidate: (decisions or {}).get(candidate, True) for candidate in candidates}
+    result = dict(decisions)
+
+    window = tk.Toplevel(master)
+    window.title("Review Notes and Short Descriptions")
+    window.transient(master)
+    tk.Label(window, text="Accepted items are kept as notes or short descriptions, "
+                          "rejected ones become ordinary text.").pack(padx=10, pady=5, anchor=tk.W)
+
+    frame = tk.Frame(window)
+    frame.pack(padx=10, pady=5, fill=tk.BOTH, expand=True)
+    table = ttk.Treeview(frame, columns=('decision', 'kind', 'text'), show='headings',
+                         height=min(max(len(candidates), 1), 20))
+    table.heading('decision', text="Decision")
+    table.heading('kind', text="Type")
+    table.heading('text', text="Text")
+    table.column('decision', width=80, stretch=False)
+    table.column('kind', width=120, stretch=False)
+    table.column('text', width=600)
+    scrollbar = tk.Scrollbar(frame, command=table.yview)
+    table.config(yscrollcommand=scrollbar.set)
+    table.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+    scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+
+    # Row ids are indexes into candidates
+    def show(index):
+        candidate = candidates[index]
+        table.item(str(index), values=("Accept" if decisions[candidate] else "Reject",
+                                       "Note" if candidate.kind == NOTE else "Short description",
+                                       candidate.text))
+
+    for index in range(len(candidates)):
+        table.insert('', tk.END, iid=str(index))
+        show(index)
+
+    def set_rows(rows, accepted=None):
+        # accepted=None toggles each row
+        for row in rows:
+            candidate = candidates[int(row)]
+            decisions[candidate] = not decisions[candidate] if accepted is None else accepted
+            show(int(row))
+
+    table.bind('<Double-1>', lambda event: set_rows(table.selection()))
+    table.bind('<space>', lambda event: set_rows(table.selection()))
+
+    buttons = tk.Frame(window)
+    buttons.pack(padx=10, pady=5, fill=tk.X)
+    for text, rows, accepted in (("Accept all", table.get_children, True),
+                                 ("Reject all", table.get_children, False),
+                                 ("Accept selected", table.selection, True),
+                                 ("Reject selected", table.selection, False)):
+        tk.Button(buttons, text=text,
+                  command=lambda rows=rows, accepted=accepted: set_rows(rows(), accepted)).pack(side=tk.LEFT, padx=(0, 5))
+
+    remember = tk.BooleanVar(value=decisions_path is not None)
+    if decisions_path is not None:
+        tk.Checkbutton(window, text=f"Save decisions to {os.path.basename(decisions_path)}",
+                       variable=remember).pack(padx=10, anchor=tk.W)
+
+    def accept():
+        result.update(decisions)
+        if remember.get():
+            try:
+                save_decisions(decisions_path, decisions)
+            except OSError as e:
+                messagebox.showerror("Error", f"Could not save the decisions:\n{str(e)}", parent=window)
+        window.destroy()
+
+    tk.Button(window, text="OK", command=accept).pack(padx=10, pady=10)
+    window.grab_set()
+    master.wait_window(window)
+    return result
@@ -0,0 +1,156 @@
+import hashlib
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_NAME_TEMPLATE = '{hash}{ext}'
+
+# Leading bytes of the image formats Word embeds
+_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', '.png'),
+    (b'\xff\xd8\xff', '.jpg'),
+    (b'GIF87a', '.gif'),
+    (b'GIF89a', '.gif'),
+    (b'BM', '.bmp'),
+    (b'II*\x00', '.tif'),
+    (b'MM\x00*', '.tif'),
+    (b'\xd7\xcd\xc6\x9a', '.wmf'),
+)
+
+# Formats PIL is asked to write, keyed by normalized target extension
+_PIL_FORMATS = {'.png': 'PNG', '.jpg': 'JPEG', '.gif': 'GIF', '.bmp': 'BMP', '.tif': 'TIFF'}
+_EXTENSION_ALIASES = {'.jpeg': '.jpg', '.tiff': '.tif'}
+
+
+def image_extension(blob):
+    for signature, ext in _SIGNATURES:
+        if blob.startswith(signature):
+            return ext
+    if blob[40:44] == b' EMF':
+        return '.emf'
+    if b'<svg' in blob[:1024]:
+        return '.svg'
+    return '.bin'
+
+
+def save_blob(blob, path):
+    # Write the original bytes when the target extension matches the image
+    # format, and only decode and re-encode with PIL when it does not.
+    target_ext = os.path.splitext(path)[1].lower()
+    target_ext = _EXTENSION_ALIASES.get(target_ext, target_ext)
+    if target_ext == image_extension(blob) or target_ext not in _PIL_FORMATS:
+        with open(path, 'wb') as f:
+            f.write(blob)
+        return
+    from PIL import Image
+    image = Image.open(io.BytesIO(blob))
+    if _PIL_FORMATS[target_ext] == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.save(path, _PIL_FORMATS[target_ext])
+
+
+class ImageWriter:
+    """Writes extracted images to one directory without prompting.
+
+    File names come from name_template, which may use {hash}, {task_id},
+    {index} and {ext}. Identical blobs are written once: within a process
+    by remembering their hash, and across batch worker processes when the
+    template contains {hash}, since the file then already exists. A name
+    the template gives to two different images is made unique with a
+    suffix within a process; across processes the template must tell them
+    apart by {hash} or {task_id}. Writes run on a thread pool; flush()
+    waits for them and re-raises the first error. With threads=0 nothing
+    is written: save() only names the file and take_deferred() hands the
+    (blob, path) pairs to whoever writes them.
+    """
+
+    def __init__(self, output_dir, name_template=DEFAULT_NAME_TEMPLATE, image_format=None, threads=4):
+        self.output_dir = output_dir
+        self.name_template = name_template
+        self.image_format = image_format
+        self.executor = ThreadPoolExecutor(max_workers=threads) if threads else None
+        self.written = {}
+        self.names = {}
+        self.pending = []
+        self.deferred = []
+        self.queued_paths = set()
+        self.lock = threading.Lock()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def save(self, blob, task_id='', index=0):
+        digest = hashlib.sha256(blob).hexdigest()
+        with self.lock:
+            path = self.written.get(digest)
+            if path is not None:
+                return path
+            ext = '.' + self.image_format.lower().lstrip('.') if self.image_format else image_extension(blob)
+            name = self.name_template.format(hash=digest[:16], task_id=task_id, index=index, ext=ext)
+            path = os.path.join(self.output_dir, name)
+            # A name already taken by a different image gets a -2, -3, ...
+            # suffix rather than overwriting it
+            base, name_ext = os.path.splitext(path)
+            suffix = 1
+            while self.names.get(path, digest) != digest:
+                suffix += 1
+                path = f'{base}-{suffix}{name_ext}'
+            self.names[path] = digest
+            self.written[digest] = path
+        if '{hash' in self.name_template and os.path.exists(path):
+            return path
+        if self.executor is None:
+            self.deferred.append((blob, path))
+        else:
+            self.pending.append(self.executor.submit(self._write, blob, path, digest))
+        return path
+
+    def take_deferred(self):
+        deferred, self.deferred = self.deferred, []
+        return deferred
+
+    def write(self, blob, path):
+        # Queue a blob already named by a deferred writer, e.g. in a worker
+        # process, unless that file was queued before.
+        with self.lock:
+            if path in self.queued_paths:
+                return
+            self.queued_paths.add(path)
+        self.pending.append(self.executor.submit(self._write, blob, path, None))
+
+    def _write(self, blob, path, digest):
+        # Write to a temporary name first so a concurrent worker never sees
+        # a partial file.
+        base, ext = os.path.splitext(path)
+        tmp_path = f'{base}.{os.getpid()}-{threading.get_ident()}.tmp{ext}'
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            save_blob(blob, tmp_path)
+            os.replace(tmp_path, path)
+        except Exception:
+            with self.lock:
+                self.written.pop(digest, None)
+                self.queued_paths.discard(path)
+            raise
+
+    def saver(self, task_id, dita_path):
+        # Callback for ConversionOptions.save_image that returns hrefs
+        # relative to the .dita file.
+        dita_dir = os.path.dirname(os.path.abspath(dita_path))
+        counter = iter(range(1, 1 << 31))
+
+        def save_image(blob):
+            path = self.save(blob, task_id, next(counter))
+            return os.path.relpath(os.path.abspath(path), dita_dir).replace(os.sep, '/')
+        return save_image
+
+    def flush(self):
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
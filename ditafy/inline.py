@@ -0,0 +1,204 @@
+import json
+import xml.etree.ElementTree as ET
+
+# Inline elements a run's formatting can map to
+B = 'b'
+I = 'i'
+CODEPH = 'codeph'
+UICONTROL = 'uicontrol'
+INLINE_ELEMENTS = (B, I, CODEPH, UICONTROL)
+# Nesting order, outermost first; links to web pages become an <xref>
+# around them
+_ORDER = {UICONTROL: 0, CODEPH: 1, B: 2, I: 3}
+_EMPHASIS = (B, I)
+
+# Character style names (or ids or aliases, compared case-insensitively)
+# and their elements. Styles based on one of these inherit its element.
+# Other character styles map by their own bold, italic and font settings.
+DEFAULT_CHARACTER_STYLES = {
+    'Strong': B,
+    'Emphasis': I,
+    'Subtle Emphasis': I,
+    'Intense Emphasis': B,
+    'Book Title': I,
+    'HTML Code': CODEPH,
+    'HTML Keyboard': CODEPH,
+    'HTML Typewriter': CODEPH,
+    'HTML Variable': I,
+    'Code': CODEPH,
+    'Inline Code': CODEPH,
+    'UI Control': UICONTROL,
+    'UIControl': UICONTROL,
+    'GUI Label': UICONTROL,
+}
+
+# Runs set in one of these fonts are code
+MONOSPACE_FONTS = {'consolas', 'courier', 'courier new', 'lucida console', 'lucida sans typewriter',
+                   'menlo', 'monaco', 'source code pro', 'cascadia code', 'cascadia mono', 'dejavu sans mono'}
+
+
+def load_character_styles(path):
+    # Read a JSON object of character style name -> inline element, merged
+    # over the defaults.
+    with open(path, 'r', encoding='utf-8') as f:
+        character_styles = json.load(f)
+    for style, element in character_styles.items():
+        if element not in INLINE_ELEMENTS:
+            raise ValueError(f"Unknown inline element {element!r} for style {style!r}, "
+                             f"expected one of {', '.join(INLINE_ELEMENTS)}")
+    return {**DEFAULT_CHARACTER_STYLES, **character_styles}
+
+
+def _format_marks(fmt):
+    marks = set()
+    if fmt.bold:
+        marks.add(B)
+    if fmt.italic:
+        marks.add(I)
+    if fmt.font and fmt.font.casefold() in MONOSPACE_FONTS:
+        marks.add(CODEPH)
+    return marks
+
+
+def build_character_marks(stylesheet, character_styles=None):
+    """Resolve every character style of a document to its inline elements once.
+
+    A style matching a character_styles entry by UI name, style id or alias
+    maps to that element; otherwise it takes the elements of the nearest
+    style it is based on, or failing that its own bold, italic and font.
+    """
+    if character_styles is None:
+        character_styles = DEFAULT_CHARACTER_STYLES
+    wanted = {name.casefold(): element for name, element in character_styles.items()}
+
+    table = {}
+    for style_id, style in stylesheet.character.items():
+        for name in (style.name, style_id) + style.aliases:
+            if name and name.casefold() in wanted:
+                table[style_id] = frozenset([wanted[name.casefold()]])
+                break
+
+    for style_id in stylesheet.character:
+        chain = []
+        current = style_id
+        # Follow basedOn to the first mapped style, guarding against cycles
+        while current is not None and current not in table and current not in chain:
+            chain.append(current)
+            style = stylesheet.character.get(current)
+            current = style.based_on if style is not None else None
+        inherited = table.get(current)
+        for resolved in chain:
+            style = stylesheet.character.get(resolved)
+            if inherited is not None:
+                table[resolved] = inherited
+            else:
+                table[resolved] = frozenset(_format_marks(style.format)) if style is not None else frozenset()
+    return table
+
+
+class InlineFormatter:
+    """Turns the Segments of a paragraph (see ditafy.reader) into DITA inline markup.
+
+    Each distinct RunFormat is mapped to its elements once and cached, so
+    the cost per run is a dict lookup. Neighbouring segments that end up
+    with the same elements, such as a bold run next to a run in the Strong
+    style, are joined again before any markup is built. Bold or italic
+    covering all of an element's text is left out.
+    """
+
+    def __init__(self, stylesheet, character_styles=None):
+        self.style_marks = build_character_marks(stylesheet, character_styles)
+        self._marks = {}
+
+    def marks(self, fmt):
+        if fmt not in self._marks:
+            marks = set(self.style_marks.get(fmt.style, ()))
+            marks |= _format_marks(fmt)
+            # UI controls are bold already
+            if UICONTROL in marks:
+                marks.discard(B)
+            self._marks[fmt] = (tuple(sorted(marks, key=_ORDER.get)), fmt.href)
+        return self._marks[fmt]
+
+    def spans(self, runs, start, end):
+        # [(text, elements, href)] for the characters start:end of the
+        # paragraph text, or None when none of them are formatted
+        pieces = []
+        pos = 0
+        for text, fmt in runs:
+            segment_end = pos + len(text)
+            if segment_end > start and pos < end:
+                text = text[max(start - pos, 0):end - pos]
+                # Formatting on nothing but spaces is dropped
+                pieces.append((text, *self.marks(fmt)) if text.strip() else (text, (), None))
+            pos = segment_end
+            if pos >= end:
+                break
+
+        # Bold or italic over the whole text, such as a paragraph typed in
+        # bold, is presentation rather than markup
+        whole = set(_EMPHASIS)
+        for text, marks, href in pieces:
+            if text.strip():
+                whole.intersection_update(marks)
+        spans = []
+        formatted = False
+        for text, marks, href in pieces:
+            if whole:
+                marks = tuple(mark for mark in marks if mark not in whole)
+            if spans and spans[-1][1] == marks and spans[-1][2] == href:
+                spans[-1] = (spans[-1][0] + text, marks, href)
+            else:
+                spans.append((text, marks, href))
+            formatted = formatted or bool(marks) or href is not None
+        return spans if formatted else None
+
+    def fill(self, element, runs, text):
+        # Set element's content to text, a stripped part of the paragraph
+        # whose segments are runs, keeping its formatting.
+        offsets = _locate(runs, text) if runs else None
+        spans = self.spans(runs, *offsets) if offsets else None
+        if spans is None:
+            element.text = text
+            return
+        element.text = None
+        # Spans with the same link share one <xref>
+        link = link_href = None
+        for span_text, marks, href in spans:
+            if href is None:
+                container = element
+                link = link_href = None
+            else:
+                if link is None or link_href != href:
+                    link = ET.SubElement(element, 'xref', href=href, scope='external', format='html')
+                    link_href = href
+                container = link
+            if not marks:
+                _append_text(container, span_text)
+                continue
+            # Spaces around formatted text stay outside its elements
+            core = span_text.strip()
+            lead = span_text[:len(span_text) - len(span_text.lstrip())]
+            _append_text(container, lead)
+            parent = container
+            for mark in marks:
+                parent = ET.SubElement(parent, mark)
+            parent.text = core
+            _append_text(container, span_text[len(lead) + len(core):])
+
+
+def _locate(runs, text):
+    # text is the paragraph text or a part of it ending where the stripped
+    # text ends, as the converter takes it; find its offsets
+    full = ''.join(segment_text for segment_text, _ in runs)
+    start = full.rfind(text)
+    return (start, start + len(text)) if start >= 0 else None
+
+
+def _append_text(element, text):
+    if not text:
+        return
+    if len(element):
+        element[-1].tail = (element[-1].tail or '') + text
+    else:
+        element.text = (element.text or '') + text
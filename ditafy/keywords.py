@@ -0,0 +1,497 @@
+import heapq
+import re
+import xml.etree.ElementTree as ET
+from collections import deque
+
+# Elements that can reference a key in keyref mode
+KEYREF_ELEMENTS = ('ph', 'keyword')
+# Characters a DITA key name cannot contain
+_INVALID_KEY = re.compile(r'[\s{}\[\]/#?]')
+# A keyword written /pattern/flags is a regular expression rule. Flags:
+# i ignores case, w matches whole words only.
+_PATTERN_RULE = re.compile(r'/(.+)/([iw]*)', re.S)
+_PATTERN_LINE = re.compile(r'(/.+?/[iw]*)\s*:(.*)')
+# Rules standing for at most this many phrases are matched as phrases
+MAX_EXPANSIONS = 256
+# Numbered or named groups a rule refers to, or defines by name. Such a
+# rule is scanned on its own, as joining it with other rules would
+# renumber its groups or clash with their names.
+_GROUP_REFERENCE = re.compile(r'\\[1-9]|\(\?P[<=]|\(\?\(')
+
+
+def parse_rule(original):
+    # (regular expression, flags) of a /pattern/flags keyword, or None for
+    # a plain phrase
+    rule = _PATTERN_RULE.fullmatch(original)
+    return rule.groups() if rule else None
+
+
+def parse_replacements(text):
+    # Parse 'ORIGINALPHRASE : NEWPHRASE' lines, as typed in the preferences
+    # dialog or posted to the web service. A /pattern/flags rule may itself
+    # contain colons.
+    replacements = {}
+    for line in text.strip().split('\n'):
+        rule = _PATTERN_LINE.match(line.strip())
+        if rule:
+            replacements[rule.group(1)] = rule.group(2).strip()
+        elif ':' in line:
+            original, new = map(str.strip, line.split(':', 1))
+            replacements[original] = new
+    return replacements
+
+
+def check_phrase_rules(replacements):
+    # Raise ValueError for a /pattern/ rule that is a regular expression
+    # rather than a set of phrases (see expand_pattern). Tables from
+    # untrusted sources are checked with this, since a regular expression
+    # can take exponential time on a crafted text.
+    for original in replacements:
+        rule = parse_rule(original)
+        if rule is not None and expand_pattern(rule[0]) is None:
+            raise ValueError(f"{original!r}: only literal text, [abc], ? and | are allowed in rules here")
+
+
+class _NotSimple(Exception):
+    pass
+
+
+def expand_pattern(pattern):
+    # Every string a pattern matches, when it is built only from literal
+    # text, escaped punctuation, [abc] sets, ? and | (in groups or not), and
+    # matches at most MAX_EXPANSIONS strings; otherwise None
+    try:
+        strings, pos = _expand_alternation(pattern, 0)
+    except _NotSimple:
+        return None
+    return strings if pos == len(pattern) else None
+
+
+def _expand_alternation(pattern, pos):
+    strings = []
+    while True:
+        branch, pos = _expand_sequence(pattern, pos)
+        strings.extend(branch)
+        if not pattern.startswith('|', pos):
+            break
+        pos += 1
+    strings = list(dict.fromkeys(strings))
+    if len(strings) > MAX_EXPANSIONS:
+        raise _NotSimple
+    return strings, pos
+
+
+def _expand_sequence(pattern, pos):
+    strings = ['']
+    while pos < len(pattern) and pattern[pos] not in '|)':
+        ch = pattern[pos]
+        if ch == '(':
+            pos += 2 if pattern.startswith('?:', pos + 1) else 1
+            if pattern.startswith('?', pos):
+                raise _NotSimple
+            atom, pos = _expand_alternation(pattern, pos)
+            if not pattern.startswith(')', pos):
+                raise _NotSimple
+            pos += 1
+        elif ch == '[':
+            end = pattern.find(']', pos + 2)
+            chars = pattern[pos + 1:end]
+            if end < 0 or any(c in '\\^-[' for c in chars):
+                raise _NotSimple
+            atom = list(dict.fromkeys(chars))
+            pos = end + 1
+        elif ch == '\\':
+            escaped = pattern[pos + 1:pos + 2]
+            # \d, \b, \w and the like are not literal
+            if not escaped or escaped.isalnum() or escaped == '_':
+                raise _NotSimple
+            atom = [escaped]
+            pos += 2
+        elif ch in '.^$*+?{}]':
+            raise _NotSimple
+        else:
+            atom = [ch]
+            pos += 1
+        if pattern.startswith('?', pos):
+            atom = [''] + atom
+            pos += 1
+        if pos < len(pattern) and pattern[pos] in '*+?{':
+            raise _NotSimple
+        strings = [string + tail for string in strings for tail in atom]
+        if len(strings) > MAX_EXPANSIONS:
+            raise _NotSimple
+    return strings, pos
+
+
+def _fold(text):
+    # Lower-case text without changing its length, so offsets still apply
+    folded = text.lower()
+    if len(folded) == len(text):
+        return folded
+    return ''.join(ch.lower() if len(ch.lower()) == 1 else ch for ch in text)
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+
+def _whole_word(text, start, end):
+    return not (start and _is_word_char(text[start - 1])) and not (end < len(text) and _is_word_char(text[end]))
+
+
+class _Automaton:
+    """Aho-Corasick automaton over phrases, each leading to a keyword of the table.
+
+    A phrase can come from several keywords, tried in the order they were
+    added; a keyword added with whole_word only counts between word
+    boundaries.
+    """
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        # Length of the phrase ending at each node (0 if none), and the
+        # nearest node on the fail chain that ends a phrase.
+        self.length = [0]
+        self.dict_link = [0]
+        # (keyword, whole_word) of each node's phrase, and its keyword when
+        # the first of them needs no boundary check
+        self.outputs = [()]
+        self.plain = [None]
+
+    def __bool__(self):
+        return len(self.goto) > 1
+
+    def add(self, phrase, keyword, whole_word=False):
+        node = 0
+        for ch in phrase:
+            nxt = self.goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self.goto)
+                self.goto[node][ch] = nxt
+                self.goto.append({})
+                self.fail.append(0)
+                self.length.append(0)
+                self.dict_link.append(0)
+                self.outputs.append(())
+                self.plain.append(None)
+            node = nxt
+        self.length[node] = len(phrase)
+        self.outputs[node] += ((keyword, whole_word),)
+        first_keyword, first_whole_word = self.outputs[node][0]
+        self.plain[node] = None if first_whole_word else first_keyword
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, child in self.goto[node].items():
+                queue.append(child)
+                fail = self.fail[node]
+                while fail and ch not in self.goto[fail]:
+                    fail = self.fail[fail]
+                target = self.goto[fail].get(ch, 0)
+                self.fail[child] = target if target != child else 0
+                fail = self.fail[child]
+                self.dict_link[child] = fail if self.length[fail] else self.dict_link[fail]
+
+    def candidates(self, text, haystack=None):
+        # (start, end, keyword) of the longest match at each start, in
+        # order; matches at different starts may overlap. haystack, the
+        # same length as text, is scanned in its place.
+        goto, fail, length, dict_link, plain = self.goto, self.fail, self.length, self.dict_link, self.plain
+        longest = {}
+        node = 0
+        for i, ch in enumerate(text if haystack is None else haystack):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            out = node if length[node] else dict_link[node]
+            while out:
+                start = i + 1 - length[out]
+                if length[out] > longest.get(start, (0,))[0]:
+                    keyword = plain[out] or self._keyword(out, text, start, i + 1)
+                    if keyword is not None:
+                        longest[start] = (length[out], keyword)
+                out = dict_link[out]
+        return [(start, start + longest[start][0], longest[start][1]) for start in sorted(longest)]
+
+    def find(self, text, haystack=None):
+        # Non-overlapping (start, end, keyword) matches, leftmost-longest
+        return _leftmost_longest(self.candidates(text, haystack))
+
+    def _keyword(self, node, text, start, end):
+        for keyword, whole_word in self.outputs[node]:
+            if not whole_word or _whole_word(text, start, end):
+                return keyword
+        return None
+
+
+class KeywordMatcher:
+    """Aho-Corasick matcher that applies every keyword replacement in one scan.
+
+    Overlapping matches are resolved leftmost-longest, so with both "Widget"
+    and "Widget Pro" configured, "Widget Pro" wins wherever it appears.
+
+    Keywords written /pattern/flags are rules, with flags i (ignore case)
+    and w (whole words only): /widgets?/iw matches "Widget" and "widgets"
+    but not "widgetry". Rules that stand for a limited set of phrases
+    (literal text, [abc], ? and |) join the phrases in the automaton, or
+    in a second one over the lower-cased text, so they cost no more than
+    phrases. Other rules are regular expressions, compiled together into
+    one alternation and scanned once per text; those with backreferences
+    or named groups are scanned on their own. At one position the longer
+    match wins; on a tie, phrases and case-sensitive rules come first, then
+    case-insensitive ones, then regular expressions, each in table order.
+
+    With keyref set to 'ph' or 'keyword', every replacement value is a key
+    name instead, and matches become <ph keyref="key"/> (or <keyword>)
+    elements. The keys matched are remembered until take_referenced(), for
+    a key definition map (see build_keys_map).
+    """
+
+    def __init__(self, replacements, keyref=None):
+        if keyref is not None and keyref not in KEYREF_ELEMENTS:
+            raise ValueError(f"keyref must be one of {', '.join(KEYREF_ELEMENTS)}")
+        self.replacements = dict(replacements)
+        self.keyref = keyref
+        # First phrase of each key, which its key definition shows
+        self.key_texts = {}
+        self._keys = {}
+        self._referenced = set()
+        self._templates = {}
+        self._phrases = _Automaton()
+        # Case-insensitive rules, matched against the lower-cased text
+        self._folded = _Automaton()
+        # Keyword of each regular expression, by its place in the alternation
+        self._rules = []
+        self._pattern = None
+        # (pattern, keyword) of rules that refer to their own groups
+        self._separate = []
+
+        alternatives = []
+        rule_texts = {}
+        for original, new in self.replacements.items():
+            if not original:
+                continue
+            rule = parse_rule(original)
+            if rule is None:
+                self._phrases.add(original, original)
+                text = original
+            else:
+                text = self._add_rule(original, *rule, alternatives)
+            if keyref is None:
+                self._templates[original] = _compile_template(new)
+                continue
+            key = new.strip()
+            if not key or _INVALID_KEY.search(key):
+                raise ValueError(f"Invalid key name {new!r} for {original!r}")
+            self._keys[original] = key
+            # Keys only rules match show the first phrase of their first rule
+            (self.key_texts if rule is None else rule_texts).setdefault(key, text)
+            self._templates[original] = (None, [ET.Element(keyref, keyref=key)])
+        for key, text in rule_texts.items():
+            self.key_texts.setdefault(key, text)
+        self._phrases.build()
+        self._folded.build()
+        if alternatives:
+            try:
+                self._pattern = re.compile(f"(?={'|'.join(alternatives)})")
+            except re.error as e:
+                raise ValueError(f"Invalid keyword patterns: {e}") from None
+
+    def __bool__(self):
+        return bool(self._templates)
+
+    def _add_rule(self, original, pattern, flags, alternatives):
+        # Returns a phrase the rule matches, or its pattern
+        phrases = expand_pattern(pattern)
+        if phrases is None:
+            rule = _compile_rule(original, pattern, flags)
+            if _GROUP_REFERENCE.search(pattern):
+                # An empty group after the rule marks where it ends, and
+                # leaves the numbers of the rule's own groups alone
+                try:
+                    self._separate.append((re.compile(f'(?={rule}(?P<_rule_end>))'), original))
+                except re.error as e:
+                    raise ValueError(f"Invalid pattern {original!r}: {e}") from None
+            else:
+                alternatives.append(f'(?P<_rule{len(self._rules)}>{rule})')
+                self._rules.append(original)
+            return pattern
+        for phrase in phrases:
+            if not phrase:
+                continue
+            if 'i' in flags:
+                self._folded.add(_fold(phrase), original, 'w' in flags)
+            else:
+                self._phrases.add(phrase, original, 'w' in flags)
+        return next((phrase for phrase in phrases if phrase), pattern)
+
+    def find(self, text):
+        # Returns non-overlapping (start, end) spans, leftmost-longest.
+        return [(start, end) for start, end, _ in self._matches(text)]
+
+    def _matches(self, text):
+        # (start, end, keyword) of every match. Candidates from all three
+        # matchers, overlaps included, are resolved together, so a long
+        # match from one cannot be hidden by a shorter one another matcher
+        # chose over it.
+        found = []
+        if self._phrases:
+            found.append(self._phrases.candidates(text))
+        if self._folded:
+            found.append(self._folded.candidates(text, _fold(text)))
+        if self._pattern is not None:
+            # The pattern is a lookahead, so it matches at every start
+            found.append([(match.start(match.lastgroup), match.end(match.lastgroup),
+                           self._rules[int(match.lastgroup[5:])])
+                          for match in self._pattern.finditer(text)
+                          if match.end(match.lastgroup) > match.start(match.lastgroup)])
+        for pattern, original in self._separate:
+            found.append([(match.start(), match.start('_rule_end'), original)
+                          for match in pattern.finditer(text) if match.start('_rule_end') > match.start()])
+        found = [matches for matches in found if matches]
+        if len(found) <= 1:
+            return _leftmost_longest(found[0]) if found else []
+        # Each list is in order already, and merge is stable
+        return _leftmost_longest(heapq.merge(*found, key=lambda match: (match[0], match[0] - match[1])))
+
+    def replace_text(self, text):
+        # Plain-string replacement; markup in replacement values is kept verbatim.
+        if not text or not self:
+            return text
+        parts = []
+        pos = 0
+        for start, end, original in self._matches(text):
+            parts.append(text[pos:start])
+            parts.append(self.replacements[original])
+            pos = end
+        parts.append(text[pos:])
+        return ''.join(parts)
+
+    def apply(self, root):
+        # Replace keywords in the text nodes of an element tree, in place.
+        # Tag names and attribute values are never touched. Replacement values
+        # containing markup (e.g. <ph keyref="product"/>) are inserted as elements.
+        if not self:
+            return 0
+        count = 0
+        for parent in list(root.iter()):
+            # Only the original text nodes are scanned, never the tails of
+            # elements inserted for a replacement
+            children = list(parent)
+            lead, elements, found = self._render(parent.text)
+            count += found
+            if found:
+                parent.text = lead
+                for offset, element in enumerate(elements):
+                    parent.insert(offset, element)
+            for child in children:
+                lead, elements, found = self._render(child.tail)
+                count += found
+                if found:
+                    child.tail = lead
+                    index = list(parent).index(child)
+                    for offset, element in enumerate(elements, 1):
+                        parent.insert(index + offset, element)
+        return count
+
+    def take_referenced(self):
+        # Keys matched since the last call, in keyref mode
+        referenced, self._referenced = self._referenced, set()
+        return referenced
+
+    def _render(self, text):
+        if not text:
+            return text, [], 0
+        spans = self._matches(text)
+        if not spans:
+            return text, [], 0
+
+        lead = None
+        elements = []
+        pos = 0
+
+        def add_text(value):
+            nonlocal lead
+            if not value:
+                return
+            if elements:
+                elements[-1].tail = (elements[-1].tail or '') + value
+            else:
+                lead = (lead or '') + value
+
+        for start, end, original in spans:
+            add_text(text[pos:start])
+            if self.keyref is not None:
+                self._referenced.add(self._keys[original])
+            template_text, template_elements = self._templates[original]
+            add_text(template_text)
+            for element in template_elements:
+                copy = _copy_element(element)
+                tail = copy.tail
+                copy.tail = None
+                elements.append(copy)
+                add_text(tail)
+            pos = end
+        add_text(text[pos:])
+        return lead, elements, len(spans)
+
+
+def _leftmost_longest(candidates):
+    # Non-overlapping matches from candidates ordered by start and, at one
+    # start, longest first
+    matches = []
+    pos = 0
+    for start, end, keyword in candidates:
+        if start >= pos:
+            matches.append((start, end, keyword))
+            pos = end
+    return matches
+
+
+def _compile_rule(original, pattern, flags):
+    # A rule's pattern with its flags applied, checked in that form
+    rule = f'(?:{pattern})'
+    if 'w' in flags:
+        rule = rf'(?<!\w){rule}(?!\w)'
+    if 'i' in flags:
+        rule = f'(?i:{rule})'
+    try:
+        re.compile(rule)
+    except re.error as e:
+        raise ValueError(f"Invalid pattern {original!r}: {e}") from None
+    return rule
+
+
+def _compile_template(value):
+    # Split a replacement value into leading text and element fragments.
+    if '<' not in value:
+        return value, []
+    try:
+        wrapper = ET.fromstring(f'<wrapper>{value}</wrapper>')
+    except ET.ParseError:
+        return value, []
+    return wrapper.text, list(wrapper)
+
+
+def _copy_element(element):
+    copy = ET.Element(element.tag, element.attrib)
+    copy.text = element.text
+    copy.tail = element.tail
+    for child in element:
+        copy.append(_copy_element(child))
+    return copy
+
+
+def build_keys_map(key_texts, keys=None):
+    # A <map> defining each key in keys (default: all of key_texts) with
+    # its text, for topics converted in keyref mode to reference.
+    keys_map = ET.Element('map')
+    ET.SubElement(keys_map, 'title').text = 'Keys'
+    for key in sorted(key_texts if keys is None else keys):
+        keydef = ET.SubElement(keys_map, 'keydef', keys=key)
+        keywords = ET.SubElement(ET.SubElement(keydef, 'topicmeta'), 'keywords')
+        ET.SubElement(keywords, 'keyword').text = key_texts[key]
+    return keys_map
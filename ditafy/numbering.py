@@ -0,0 +1,87 @@
+from docx.oxml.ns import qn
+
+_W_VAL = qn('w:val')
+_W_ILVL = qn('w:ilvl')
+_W_LVL = qn('w:lvl')
+_W_NUMFMT = qn('w:numFmt')
+_W_ABSTRACT_NUM_ID = qn('w:abstractNumId')
+
+BULLET = 'bullet'
+
+
+class Numbering:
+    """Index of numbering.xml, built once per document.
+
+    Maps each w:num to the formats of its abstract definition's levels,
+    with any w:lvlOverride applied, so looking up the format of a list
+    paragraph is a dict access.
+    """
+
+    def __init__(self, numbering_element):
+        self.formats = {}
+        if numbering_element is None:
+            return
+        abstract_formats = {}
+        for abstract in numbering_element.iterchildren(qn('w:abstractNum')):
+            abstract_formats[abstract.get(_W_ABSTRACT_NUM_ID)] = _level_formats(abstract)
+        for num in numbering_element.iterchildren(qn('w:num')):
+            abstract_id = num.find(_W_ABSTRACT_NUM_ID)
+            formats = dict(abstract_formats.get(abstract_id.get(_W_VAL), {}) if abstract_id is not None else {})
+            for override in num.iterchildren(qn('w:lvlOverride')):
+                formats.update(_level_formats(override))
+            self.formats[num.get(qn('w:numId'))] = formats
+
+    def level_format(self, num_id, ilvl):
+        # numFmt of a list level ("decimal", "bullet", ...), or None when the
+        # paragraph is not numbered. numId 0 explicitly removes numbering.
+        formats = self.formats.get(num_id)
+        if formats is None:
+            return None
+        return formats.get(ilvl, 'decimal')
+
+
+def _level_formats(element):
+    formats = {}
+    for lvl in element.iterchildren(_W_LVL):
+        numfmt = lvl.find(_W_NUMFMT)
+        formats[int(lvl.get(_W_ILVL, '0'))] = numfmt.get(_W_VAL) if numfmt is not None else 'decimal'
+    return formats
+
+
+def build_style_numbering(stylesheet):
+    # Effective (numId, ilvl) of every paragraph style, following basedOn
+    # for whichever of the two the style does not set itself.
+    table = {}
+
+    def resolve(style_id, seen):
+        if style_id in table:
+            return table[style_id]
+        style = stylesheet.styles.get(style_id)
+        if style is None or style_id in seen:
+            return None, None
+        seen.add(style_id)
+        num_id, ilvl = style.num_id, style.ilvl
+        if (num_id is None or ilvl is None) and style.based_on is not None:
+            base_num_id, base_ilvl = resolve(style.based_on, seen)
+            num_id = num_id if num_id is not None else base_num_id
+            ilvl = ilvl if ilvl is not None else base_ilvl
+        table[style_id] = (num_id, ilvl)
+        return table[style_id]
+
+    for style_id in stylesheet.styles:
+        resolve(style_id, set())
+    return table
+
+
+def list_level(para, style_numbering, numbering):
+    # (ilvl, numFmt) of a paragraph's effective numbering, or None when it
+    # is not a list item. Direct w:numPr values win over the style's.
+    style_num_id, style_ilvl = style_numbering.get(para.style_id, (None, None))
+    num_id = para.num_id if para.num_id is not None else style_num_id
+    if num_id is None or num_id == '0':
+        return None
+    ilvl = para.ilvl if para.ilvl is not None else (style_ilvl or 0)
+    level_format = numbering.level_format(num_id, ilvl)
+    if level_format is None or level_format == 'none':
+        return None
+    return ilvl, level_format
@@ -0,0 +1,255 @@
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from ditafy import CONVERTER_VERSION
+from ditafy.cache import keywords_hash
+from ditafy.keywords import KeywordMatcher
+
+# Version of the preferences file format. Files without one (version 1)
+# are a plain object of keyword replacements, read as the default profile.
+FORMAT_VERSION = 2
+DEFAULT_PROFILE = 'default'
+# Directory for compiled matchers shared between processes; 'off' disables it
+CACHE_ENV_VAR = 'DITAFY_CACHE_DIR'
+# Compiled matchers kept in memory per process
+MAX_CACHED_MATCHERS = 16
+# Compiled matchers kept in the cache directory; the least recently used
+# ones are deleted beyond this
+MAX_CACHE_FILES = 64
+
+_matchers = OrderedDict()
+_matchers_lock = threading.Lock()
+
+
+def default_cache_dir():
+    value = os.environ.get(CACHE_ENV_VAR, '').strip()
+    if value.lower() in ('0', 'off', 'false', 'no'):
+        return None
+    return value or os.path.join(os.path.expanduser('~'), '.cache', 'ditafy')
+
+
+def _private_dir(path):
+    # Create path for this user only. True when it can be trusted with
+    # pickles: it belongs to this user and nobody else can write to it.
+    try:
+        os.makedirs(path, mode=0o700, exist_ok=True)
+        stat = os.stat(path)
+    except OSError:
+        return False
+    if hasattr(os, 'getuid') and stat.st_uid != os.getuid():
+        return False
+    return not stat.st_mode & 0o022
+
+
+def _evict(cache_dir):
+    # Delete the least recently used matchers beyond MAX_CACHE_FILES
+    paths = []
+    for name in os.listdir(cache_dir):
+        if name.startswith('matcher-') and name.endswith('.pickle'):
+            path = os.path.join(cache_dir, name)
+            try:
+                paths.append((os.stat(path).st_mtime, path))
+            except OSError:
+                pass
+    paths.sort(reverse=True)
+    for _, path in paths[MAX_CACHE_FILES:]:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+def compiled_matcher(keyword_replacements, keyref=None, cache_dir=None, persist=True):
+    """Return a KeywordMatcher for keyword_replacements, compiling it at most once.
+
+    Matchers are kept in memory by the hash of the table and keyref mode,
+    so every conversion with the same table shares one. They are also
+    pickled to cache_dir (default: see default_cache_dir), where batch
+    workers and web server processes load them instead of compiling the
+    table again. Pickles are code, so the directory is created for the
+    current user only and ignored when it belongs to someone else or
+    others can write to it. It keeps the MAX_CACHE_FILES most recently
+    used matchers. A damaged cache file is compiled again. With
+    persist=False the disk cache is neither read nor written, for tables
+    that come from untrusted clients and would otherwise pile up.
+    """
+    digest = hashlib.sha256(f'{CONVERTER_VERSION}\0{keyref}\0{keywords_hash(keyword_replacements)}'
+                            .encode('utf-8')).hexdigest()
+    with _matchers_lock:
+        matcher = _matchers.get(digest)
+        if matcher is not None:
+            _matchers.move_to_end(digest)
+            return matcher
+
+    cache_dir = (cache_dir or default_cache_dir()) if persist else None
+    if cache_dir and not _private_dir(cache_dir):
+        cache_dir = None
+    path = os.path.join(cache_dir, f'matcher-{digest}.pickle') if cache_dir else None
+    matcher = None
+    if path and os.path.exists(path):
+        try:
+            with open(path, 'rb') as f:
+                matcher = pickle.load(f)
+            # The modification time records the last use, for _evict
+            os.utime(path)
+        except Exception:
+            matcher = None
+    if not isinstance(matcher, KeywordMatcher):
+        matcher = KeywordMatcher(keyword_replacements, keyref)
+        if path:
+            try:
+                tmp_path = f'{path}.{os.getpid()}.tmp'
+                with open(tmp_path, 'wb') as f:
+                    pickle.dump(matcher, f, protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(tmp_path, path)
+                _evict(cache_dir)
+            except OSError:
+                pass
+
+    with _matchers_lock:
+        _matchers[digest] = matcher
+        while len(_matchers) > MAX_CACHED_MATCHERS:
+            _matchers.popitem(last=False)
+    return matcher
+
+
+def _parse(data):
+    # (profiles, revision) from the contents of a preferences file
+    if not isinstance(data, dict):
+        raise ValueError("Preferences must be a JSON object")
+    if 'version' not in data:
+        profiles = {DEFAULT_PROFILE: {'keywords': data}}
+        revision = 0
+    else:
+        if not isinstance(data['version'], int) or data['version'] > FORMAT_VERSION:
+            raise ValueError(f"Unsupported preferences version {data['version']!r}")
+        profiles = data.get('profiles', {})
+        revision = data.get('revision', 0)
+    for name, profile in profiles.items():
+        keywords = profile.get('keywords', {}) if isinstance(profile, dict) else None
+        if not isinstance(keywords, dict) or not all(isinstance(value, str) for value in keywords.values()):
+            raise ValueError(f"Profile {name!r} must hold keywords as an object of strings")
+    profiles.setdefault(DEFAULT_PROFILE, {'keywords': {}})
+    return profiles, revision
+
+
+class PreferencesStore:
+    """Named profiles of keyword replacements, kept in one JSON file.
+
+    The file holds {"version": 2, "revision": N, "profiles": {"default":
+    {"keywords": {...}}, ...}}; revision goes up with every save. A plain
+    object of replacements, as written by earlier versions, is read as the
+    default profile. reload_if_changed() picks up edits made by other
+    programs and costs one stat at most every check_interval seconds, so it
+    can run before every conversion; watch() does the same on a thread.
+    matcher() compiles each profile once, see compiled_matcher.
+    """
+
+    def __init__(self, path, cache_dir=None, check_interval=1.0):
+        self.path = path
+        self.cache_dir = cache_dir
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.profiles = {DEFAULT_PROFILE: {'keywords': {}}}
+        self.revision = 0
+        self._file_state = None
+        # Matchers by (profile, keyref), until the profiles change
+        self._matchers = {}
+        self._checked = time.monotonic()
+        self.reload()
+
+    def _stat(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload(self):
+        state = self._stat()
+        profiles, revision = {DEFAULT_PROFILE: {'keywords': {}}}, 0
+        if state is not None:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                profiles, revision = _parse(json.load(f))
+        with self.lock:
+            self.profiles = profiles
+            self.revision = revision
+            self._file_state = state
+            self._matchers = {}
+
+    def reload_if_changed(self):
+        # True when the file changed and was read again
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+        if self._stat() == self._file_state:
+            return False
+        try:
+            self.reload()
+        except (OSError, ValueError):
+            # Most likely caught mid-write; the next check reads it again
+            return False
+        return True
+
+    def watch(self, callback, interval=None):
+        # Call callback(store) on a daemon thread whenever the file changes
+        def run():
+            while True:
+                time.sleep(interval or self.check_interval)
+                if self.reload_if_changed():
+                    callback(self)
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def profile_names(self):
+        with self.lock:
+            return sorted(self.profiles)
+
+    def keywords(self, profile=None):
+        with self.lock:
+            profiles = self.profiles
+        name = profile or DEFAULT_PROFILE
+        if name not in profiles:
+            raise KeyError(f"Unknown preferences profile {name!r}")
+        return profiles[name].get('keywords', {})
+
+    def matcher(self, profile=None, keyref=None):
+        key = (profile or DEFAULT_PROFILE, keyref)
+        matcher = self._matchers.get(key)
+        if matcher is None:
+            matcher = self._matchers[key] = compiled_matcher(self.keywords(profile), keyref, self.cache_dir)
+        return matcher
+
+    def set_keywords(self, profile, keyword_replacements):
+        # Replace one profile's keywords and save. The file is read first,
+        # so changes other programs made to other profiles are kept. Raises
+        # ValueError, saving nothing, when a rule does not compile.
+        compiled_matcher(keyword_replacements, cache_dir=self.cache_dir)
+        if self._stat() != self._file_state:
+            self.reload()
+        with self.lock:
+            profiles = dict(self.profiles)
+            profiles[profile or DEFAULT_PROFILE] = {'keywords': dict(keyword_replacements)}
+            self.profiles = profiles
+            self._matchers = {}
+        self.save()
+
+    def save(self):
+        with self.lock:
+            self.revision += 1
+            data = {'version': FORMAT_VERSION, 'revision': self.revision, 'profiles': self.profiles}
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        with self.lock:
+            self._file_state = self._stat()
@@ -0,0 +1,166 @@
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Set to a file name to record JSON lines there, or to 1 for stderr
+ENV_VAR = 'DITAFY_PROFILE'
+# Request header that turns profiling on for one web request
+HEADER = 'X-Ditafy-Profile'
+
+_tracing_lock = threading.Lock()
+_tracing_users = 0
+
+
+def profile_target_from_env():
+    # Where DITAFY_PROFILE asks for JSON lines: a path, '-' for stderr, or
+    # None when profiling is off.
+    value = os.environ.get(ENV_VAR, '').strip()
+    if value.lower() in ('', '0', 'false', 'no', 'off'):
+        return None
+    if value.lower() in ('1', 'true', 'yes', 'on'):
+        return '-'
+    return value
+
+
+def _start_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        if _tracing_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        _tracing_users += 1
+
+
+def _stop_tracing():
+    global _tracing_users
+    with _tracing_lock:
+        _tracing_users -= 1
+        if _tracing_users == 0:
+            tracemalloc.stop()
+
+
+class StageProfiler:
+    """Measures each stage of a conversion, per document.
+
+    Every stage records wall and CPU time, the bytes it left allocated and
+    the peak of traced memory while it ran. Repeated stages within one
+    document, such as the topics of a split document, add up. Memory is
+    traced with tracemalloc, which slows conversions down considerably, so
+    trace_memory=False records times only. tracemalloc is process-wide: with
+    concurrent conversions in one process, memory figures overlap.
+    """
+
+    def __init__(self, trace_memory=True):
+        self.trace_memory = trace_memory
+        self.records = []
+        self.current = None
+
+    @contextmanager
+    def document(self, name):
+        if self.trace_memory:
+            _start_tracing()
+        record = {'document': name, 'stages': {}}
+        self.current = record
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield record
+        finally:
+            record['wall'] = round(time.perf_counter() - wall, 6)
+            record['cpu'] = round(time.process_time() - cpu, 6)
+            if self.trace_memory:
+                record['peak'] = max((stats['peak'] for stats in record['stages'].values()), default=0)
+                _stop_tracing()
+            self.current = None
+            self.records.append(record)
+
+    @contextmanager
+    def stage(self, name):
+        record = self.current
+        if record is None:
+            yield
+            return
+        if self.trace_memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            stats = record['stages'].setdefault(name, {'wall': 0.0, 'cpu': 0.0})
+            stats['wall'] = round(stats['wall'] + time.perf_counter() - wall, 6)
+            stats['cpu'] = round(stats['cpu'] + time.process_time() - cpu, 6)
+            if self.trace_memory:
+                current, peak = tracemalloc.get_traced_memory()
+                stats['allocated'] = stats.get('allocated', 0) + current - before
+                stats['peak'] = max(stats.get('peak', 0), peak)
+
+    def take_records(self):
+        records, self.records = self.records, []
+        return records
+
+
+class JsonLinesWriter:
+    # Appends profile records as JSON lines to a file, or to stderr for '-'
+
+    def __init__(self, target):
+        self.file = sys.stderr if target == '-' else open(target, 'a', encoding='utf-8')
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record, separators=(',', ':'))
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stderr:
+            self.file.close()
+
+
+class PrometheusMetrics:
+    """Running totals of profile records in the Prometheus text format."""
+
+    # (metric, record key, type, help)
+    STAGE_METRICS = (
+        ('ditafy_stage_seconds_total', 'wall', 'counter', "Wall time spent in each conversion stage."),
+        ('ditafy_stage_cpu_seconds_total', 'cpu', 'counter', "CPU time spent in each conversion stage."),
+        ('ditafy_stage_allocated_bytes_total', 'allocated', 'counter',
+         "Bytes left allocated by each conversion stage."),
+        ('ditafy_stage_peak_bytes', 'peak', 'gauge', "Highest traced memory seen during each stage."),
+    )
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.documents = 0
+        self.stages = {}
+
+    def add(self, record):
+        with self.lock:
+            self.documents += 1
+            for name, stats in record['stages'].items():
+                totals = self.stages.setdefault(name, {})
+                for key, value in stats.items():
+                    if key == 'peak':
+                        totals[key] = max(totals.get(key, 0), value)
+                    else:
+                        # Counters never go down; a stage that freed more
+                        # than it allocated counts as zero
+                        totals[key] = round(totals.get(key, 0) + max(value, 0), 6)
+
+    def render(self):
+        with self.lock:
+            lines = ['# HELP ditafy_profiled_documents_total Conversions profiled.',
+                     '# TYPE ditafy_profiled_documents_total counter',
+                     f'ditafy_profiled_documents_total {self.documents}']
+            for metric, key, metric_type, help_text in self.STAGE_METRICS:
+                lines.append(f'# HELP {metric} {help_text}')
+                lines.append(f'# TYPE {metric} {metric_type}')
+                for name, totals in sorted(self.stages.items()):
+                    if key in totals:
+                        lines.append(f'{metric}{{stage="{name}"}} {totals[key]}')
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,374 @@
+import posixpath
+import zipfile
+from collections import namedtuple
+
+from docx import Document
+from docx.oxml.ns import qn
+from docx.styles import BabelFish
+from lxml import etree
+
+from ditafy.numbering import Numbering
+
+# One body paragraph, reduced to what the converter needs. style_id is the
+# id used in the XML ("ListNumber2"), see ditafy.styles for turning it into
+# a role. num_id and ilvl come from the paragraph's own w:numPr and are None
+# when not set there (see ditafy.numbering for the effective numbering).
+# runs is a tuple of Segments when any of the text is formatted, else None.
+Paragraph = namedtuple('Paragraph', 'style_id text num_id ilvl image_rel_ids runs', defaults=(None,))
+
+# Direct formatting of a run, as read: bold and italic flags, the character
+# style id (w:rStyle), the font (w:rFonts) and the URL of the hyperlink
+# holding it. Links to bookmarks within the document have no href. See
+# ditafy.inline for turning it into DITA elements.
+RunFormat = namedtuple('RunFormat', 'bold italic style font href')
+PLAIN = RunFormat(False, False, None, None, None)
+# Text of adjacent runs with the same RunFormat
+Segment = namedtuple('Segment', 'text format')
+
+# A body-level table. rows is an iterator of Row records that must be
+# consumed before the next block is read, which lets the streaming reader
+# hold a single row in memory at a time.
+Table = namedtuple('Table', 'rows')
+# header is True for rows marked to repeat as a header (w:tblHeader).
+# grid_before is the number of grid columns skipped before the first cell.
+Row = namedtuple('Row', 'cells header grid_before')
+# paragraphs is the text of each paragraph in the cell. span is the number
+# of grid columns covered (w:gridSpan), vmerge 'restart' or 'continue' for
+# vertically merged cells (w:vMerge) and None otherwise.
+# runs holds the Segments of each paragraph, as in Paragraph.runs.
+Cell = namedtuple('Cell', 'paragraphs span vmerge image_rel_ids runs', defaults=(None,))
+
+# A paragraph style definition from styles.xml. name is the UI name
+# ("List Number 2"), aliases the alternative names given in w:aliases,
+# num_id and ilvl the style's own w:numPr.
+Style = namedtuple('Style', 'name aliases based_on num_id ilvl')
+# A character style definition. format is the style's own run formatting.
+CharacterStyle = namedtuple('CharacterStyle', 'name aliases based_on format')
+# All paragraph styles by id, the id of the default paragraph style and
+# all character styles by id
+StyleSheet = namedtuple('StyleSheet', 'styles default character')
+
+_RELS_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+_OFFICE_DOCUMENT = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+_STYLES = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles'
+_NUMBERING = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/numbering'
+_IMAGE = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+_HYPERLINK = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink'
+
+_W_BODY = qn('w:body')
+_W_P = qn('w:p')
+_W_R = qn('w:r')
+_W_RPR = qn('w:rPr')
+_W_HYPERLINK = qn('w:hyperlink')
+_W_TBL = qn('w:tbl')
+_W_TR = qn('w:tr')
+_W_TC = qn('w:tc')
+_W_TRPR = qn('w:trPr')
+_W_TCPR = qn('w:tcPr')
+_W_VAL = qn('w:val')
+_W_PPR = qn('w:pPr')
+_W_PSTYLE = qn('w:pStyle')
+_W_NUMPR = qn('w:numPr')
+_W_NUMID = qn('w:numId')
+_W_ILVL = qn('w:ilvl')
+_W_DRAWING = qn('w:drawing')
+_W_PICT = qn('w:pict')
+# Containers whose runs count toward the paragraph text, as in python-docx
+_RUN_CONTAINERS = {_W_HYPERLINK, qn('w:ins'), qn('w:smartTag'), qn('w:fldSimple')}
+_RUN_TEXT = {
+    qn('w:t'): None,
+    qn('w:tab'): '\t',
+    qn('w:ptab'): '\t',
+    qn('w:br'): '\n',
+    qn('w:cr'): '\n',
+    qn('w:noBreakHyphen'): '-',
+}
+# DrawingML pictures reference their image with r:embed, legacy VML
+# pictures with r:id
+_IMAGE_REFERENCES = {
+    qn('a:blip'): qn('r:embed'),
+    '{urn:schemas-microsoft-com:vml}imagedata': qn('r:id'),
+}
+
+
+def numbering_properties(ppr):
+    # (numId, ilvl) from a w:pPr, each None when absent
+    num_id = ilvl = None
+    numpr = ppr.find(_W_NUMPR) if ppr is not None else None
+    if numpr is not None:
+        for prop in numpr.iterchildren(_W_NUMID, _W_ILVL):
+            if prop.tag == _W_NUMID:
+                num_id = prop.get(_W_VAL)
+            else:
+                ilvl = int(prop.get(_W_VAL))
+    return num_id, ilvl
+
+
+def read_styles(styles_element):
+    styles = {}
+    default = None
+    character = {}
+    if styles_element is None:
+        return StyleSheet(styles, default, character)
+    for style in styles_element.iterchildren(qn('w:style')):
+        style_type = style.get(qn('w:type'), 'paragraph')
+        if style_type not in ('paragraph', 'character'):
+            continue
+        style_id = style.get(qn('w:styleId'))
+        name = style.find(qn('w:name'))
+        aliases = style.find(qn('w:aliases'))
+        based_on = style.find(qn('w:basedOn'))
+        name = BabelFish.internal2ui(name.get(_W_VAL)) if name is not None else style_id
+        aliases = tuple(alias.strip() for alias in aliases.get(_W_VAL).split(',')) if aliases is not None else ()
+        based_on = based_on.get(_W_VAL) if based_on is not None else None
+        if style_type == 'character':
+            character[style_id] = CharacterStyle(name, aliases, based_on, run_format(style.find(_W_RPR), None))
+            continue
+        styles[style_id] = Style(name, aliases, based_on, *numbering_properties(style.find(_W_PPR)))
+        if style.get(qn('w:default')) in ('1', 'true', 'on'):
+            default = style_id
+    return StyleSheet(styles, default, character)
+
+
+def run_format(rpr, href):
+    if rpr is None:
+        return PLAIN if href is None else RunFormat(False, False, None, None, href)
+    style = rpr.find(qn('w:rStyle'))
+    fonts = rpr.find(qn('w:rFonts'))
+    return RunFormat(
+        _flag(rpr, qn('w:b')),
+        _flag(rpr, qn('w:i')),
+        style.get(_W_VAL) if style is not None else None,
+        fonts.get(qn('w:ascii')) or fonts.get(qn('w:hAnsi')) if fonts is not None else None,
+        href,
+    )
+
+
+def _runs(p, links, href=None):
+    # (run, href) pairs; href is the URL of the enclosing hyperlink
+    for child in p.iterchildren():
+        if child.tag == _W_R:
+            yield child, href
+        elif child.tag == _W_HYPERLINK:
+            yield from _runs(child, links, links.get(child.get(qn('r:id'))))
+        elif child.tag in _RUN_CONTAINERS:
+            yield from _runs(child, links, href)
+
+
+def paragraph_record(p, default_style, links=None):
+    # links maps the relationship ids of external hyperlinks to their URLs
+    style_id = None
+    ppr = p.find(_W_PPR)
+    if ppr is not None:
+        pstyle = ppr.find(_W_PSTYLE)
+        if pstyle is not None:
+            style_id = pstyle.get(_W_VAL)
+    num_id, ilvl = numbering_properties(ppr)
+    if style_id is None:
+        style_id = default_style
+
+    image_rel_ids = []
+    text, runs = paragraph_text(p, image_rel_ids, links or {})
+    return Paragraph(style_id, text, num_id, ilvl, image_rel_ids, runs)
+
+
+def paragraph_text(p, image_rel_ids, links):
+    # (text, runs) of a paragraph, runs as in Paragraph.runs; relationship
+    # ids of its pictures are appended to image_rel_ids.
+    text = []
+    # Adjacent runs with the same formatting are joined into one Segment
+    segments = []
+    segment_format = PLAIN
+    segment_start = 0
+    formatted = False
+    for run, href in _runs(p, links):
+        run_start = len(text)
+        for child in run.iterchildren():
+            tag = child.tag
+            if tag in _RUN_TEXT:
+                value = _RUN_TEXT[tag]
+                text.append(child.text or '' if value is None else value)
+            elif tag == _W_DRAWING or tag == _W_PICT:
+                for element in child.iter(*_IMAGE_REFERENCES):
+                    rel_id = element.get(_IMAGE_REFERENCES[element.tag])
+                    if rel_id:
+                        image_rel_ids.append(rel_id)
+        if len(text) == run_start:
+            continue
+        rpr = run.find(_W_RPR)
+        fmt = PLAIN if rpr is None and href is None else run_format(rpr, href)
+        if fmt is not segment_format and fmt != segment_format:
+            if run_start > segment_start:
+                segments.append(Segment(''.join(text[segment_start:run_start]), segment_format))
+            segment_format = fmt
+            segment_start = run_start
+            formatted = formatted or fmt != PLAIN
+    if not formatted:
+        return ''.join(text), None
+    segments.append(Segment(''.join(text[segment_start:]), segment_format))
+    return ''.join(text), tuple(segments)
+
+
+def _flag(element, tag):
+    # On/off properties such as w:tblHeader are on when present, unless
+    # w:val says otherwise.
+    prop = element.find(tag) if element is not None else None
+    return prop is not None and prop.get(_W_VAL, 'true') not in ('0', 'false', 'off')
+
+
+def row_record(tr, links=None):
+    trpr = tr.find(_W_TRPR)
+    grid_before = trpr.find(qn('w:gridBefore')) if trpr is not None else None
+    cells = []
+    for tc in tr.iterchildren(_W_TC):
+        tcpr = tc.find(_W_TCPR)
+        span = vmerge = None
+        if tcpr is not None:
+            span = tcpr.find(qn('w:gridSpan'))
+            vmerge = tcpr.find(qn('w:vMerge'))
+        image_rel_ids = []
+        paragraphs = [paragraph_text(p, image_rel_ids, links or {}) for p in tc.iterchildren(_W_P)]
+        runs = [paragraph_runs for _, paragraph_runs in paragraphs]
+        cells.append(Cell(
+            [paragraph for paragraph, _ in paragraphs],
+            int(span.get(_W_VAL)) if span is not None else 1,
+            (vmerge.get(_W_VAL) or 'continue') if vmerge is not None else None,
+            image_rel_ids,
+            runs if any(runs) else None,
+        ))
+    return Row(cells, _flag(trpr, qn('w:tblHeader')),
+               int(grid_before.get(_W_VAL)) if grid_before is not None else 0)
+
+
+class DocxSource:
+    """Reads a document through python-docx, holding the whole body in memory."""
+
+    def __init__(self, source):
+        self.doc = Document(source)
+        self.styles = read_styles(self.doc.styles.element)
+        try:
+            numbering_element = self.doc.part.numbering_part.element
+        except (KeyError, NotImplementedError):
+            numbering_element = None
+        self.numbering = Numbering(numbering_element)
+        self.links = {rel_id: rel.target_ref for rel_id, rel in self.doc.part.rels.items()
+                      if rel.is_external and rel.reltype == _HYPERLINK}
+
+    def blocks(self):
+        # Paragraph and Table records in document order
+        for element in self.doc.element.body.iterchildren(_W_P, _W_TBL):
+            if element.tag == _W_P:
+                yield paragraph_record(element, self.styles.default, self.links)
+            else:
+                yield Table(row_record(tr, self.links) for tr in element.iterchildren(_W_TR))
+
+    def image_blob(self, rel_id):
+        rel = self.doc.part.rels.get(rel_id)
+        if rel is None or rel.is_external or rel.reltype != _IMAGE:
+            return None
+        return rel.target_part.blob
+
+    def close(self):
+        pass
+
+
+class StreamingSource:
+    """Reads word/document.xml incrementally straight from the zip.
+
+    Each body paragraph and table row is turned into a record and then
+    cleared, together with its already processed siblings, so memory stays
+    flat however long the document or its tables are. Only the small
+    styles and relationships parts are loaded up front.
+    """
+
+    def __init__(self, source):
+        self.zip = zipfile.ZipFile(source)
+        self.document_name = self._main_part()
+        self.rels, self.links = self._relationships(self.document_name)
+        self.styles = read_styles(self._related_element(_STYLES))
+        self.numbering = Numbering(self._related_element(_NUMBERING))
+
+    def _related_element(self, reltype):
+        name = next((target for target, rel_type in self.rels.values() if rel_type == reltype), None)
+        if name is None or name not in self.zip.NameToInfo:
+            return None
+        return etree.fromstring(self.zip.read(name))
+
+    def _main_part(self):
+        rels = etree.fromstring(self.zip.read('_rels/.rels'))
+        for rel in rels.iterchildren(f'{{{_RELS_NS}}}Relationship'):
+            if rel.get('Type') == _OFFICE_DOCUMENT:
+                return rel.get('Target').lstrip('/')
+        raise ValueError("Not a Word document: no main document part")
+
+    def _relationships(self, part_name):
+        directory, name = posixpath.split(part_name)
+        rels_name = posixpath.join(directory, '_rels', name + '.rels')
+        rels = {}
+        # External hyperlink targets by relationship id
+        links = {}
+        if rels_name not in self.zip.NameToInfo:
+            return rels, links
+        for rel in etree.fromstring(self.zip.read(rels_name)).iterchildren(f'{{{_RELS_NS}}}Relationship'):
+            if rel.get('TargetMode') == 'External':
+                if rel.get('Type') == _HYPERLINK:
+                    links[rel.get('Id')] = rel.get('Target')
+                continue
+            target = rel.get('Target')
+            target = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join(directory, target))
+            rels[rel.get('Id')] = (target, rel.get('Type'))
+        return rels, links
+
+    def blocks(self):
+        # Paragraph and Table records in document order
+        with self.zip.open(self.document_name) as f:
+            events = etree.iterparse(f, events=('start', 'end'), tag=(_W_P, _W_TBL, _W_TR), huge_tree=True)
+            for event, element in events:
+                parent = element.getparent()
+                if parent is None or parent.tag != _W_BODY:
+                    continue
+                if element.tag == _W_P:
+                    if event == 'end':
+                        yield paragraph_record(element, self.styles.default, self.links)
+                        _discard(element)
+                elif event == 'start':
+                    rows = self._rows(events, element)
+                    yield Table(rows)
+                    # Skip whatever rows the caller did not read
+                    for _ in rows:
+                        pass
+                    _discard(element)
+
+    def _rows(self, events, table):
+        # Continue the shared iterparse until the table ends, yielding its
+        # rows one at a time. Rows of nested tables stay inside their cell.
+        for event, element in events:
+            if event != 'end':
+                continue
+            if element is table:
+                return
+            if element.tag == _W_TR and element.getparent() is table:
+                yield row_record(element, self.links)
+                _discard(element)
+
+    def image_blob(self, rel_id):
+        target, reltype = self.rels.get(rel_id, (None, None))
+        if reltype != _IMAGE:
+            return None
+        return self.zip.read(target)
+
+    def close(self):
+        self.zip.close()
+
+
+def _discard(element):
+    # Free a processed element and the processed siblings before it
+    element.clear()
+    parent = element.getparent()
+    while element.getprevious() is not None:
+        del parent[0]
+
+
+def open_source(source, streaming=False):
+    # source is a path or a seekable binary file object
+    return StreamingSource(source) if streaming else DocxSource(source)
@@ -0,0 +1,114 @@
+import json
+import os
+from collections import namedtuple
+from dataclasses import replace
+
+from ditafy.converter import ConversionOptions, DocumentContext, ParsedDocument, build_topics, profile_stage
+from ditafy.reader import open_source
+
+NOTE = 'note'
+SHORTDESC = 'shortdesc'
+
+# A question the converter would otherwise ask while converting: whether
+# text is a note or the short description.
+Candidate = namedtuple('Candidate', 'kind text')
+
+
+class ReviewedConversion:
+    """Converts a document in two passes so every question is answered at once.
+
+    prepare() reads the document into memory, builds the topic accepting
+    every note and short description, and returns them as Candidates in
+    document order. finish() rebuilds the topic from the parsed document
+    with the reviewed decisions; the .docx is not read again and images are
+    not saved twice. Only notes (review_notes) and short descriptions
+    (review_shortdesc) are reviewed; the confirm callbacks of options are
+    not used.
+    """
+
+    def __init__(self, source, topic_id, options=None, review_notes=True, review_shortdesc=True):
+        self.source = source
+        self.topic_id = topic_id
+        self.options = options or ConversionOptions()
+        self.review_notes = review_notes
+        self.review_shortdesc = review_shortdesc
+        self.candidates = []
+        self.document = None
+        self.context = None
+        self._docx_source = None
+
+    def _recorder(self, kind):
+        def confirm(text):
+            self.candidates.append(Candidate(kind, text))
+            return True
+        return confirm
+
+    def prepare(self):
+        # The first pass only collects candidates, so it skips the keywords
+        options = replace(self.options, keyword_matcher=None,
+                          confirm_note=self._recorder(NOTE) if self.review_notes else None,
+                          confirm_shortdesc=self._recorder(SHORTDESC) if self.review_shortdesc else None)
+        with profile_stage(options, 'load'):
+            self._docx_source = open_source(self.source, streaming=options.streaming)
+            self.document = ParsedDocument(self._docx_source)
+        self.context = DocumentContext(self.document, options)
+        build_topics(self.document, self.topic_id, [options.topic_type], options, self.context)
+        return list(self.candidates)
+
+    def finish(self, decisions=None):
+        # decisions maps Candidates to True (accept) or False (reject);
+        # candidates missing from it are accepted.
+        decisions = decisions or {}
+        for candidate in self.candidates:
+            answers = self.context.note_answers if candidate.kind == NOTE else self.context.shortdesc_answers
+            answers[candidate.text] = decisions.get(candidate, True)
+        self.context.progress_counts.clear()
+        try:
+            topics = build_topics(self.document, self.topic_id, [self.options.topic_type], self.options,
+                                  self.context)
+        finally:
+            self.close()
+        return next(iter(topics.values()))
+
+    def close(self):
+        if self._docx_source is not None:
+            self._docx_source.close()
+            self._docx_source = None
+
+
+def decisions_path_for(docx_path):
+    # Decisions for "manual.docx" are kept in "manual.decisions.json" next to it
+    return os.path.splitext(docx_path)[0] + '.decisions.json'
+
+
+def load_decisions(path):
+    # Read a decisions file, a JSON object such as
+    # {"note": {"Keep dry.": true}, "shortdesc": {"Installs the pump.": false}},
+    # into a dict mapping Candidates to True (accept) or False (reject).
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    decisions = {}
+    for kind in (NOTE, SHORTDESC):
+        for text, accepted in data.get(kind, {}).items():
+            if not isinstance(accepted, bool):
+                raise ValueError(f"{path}: decision for {kind} {text!r} must be true or false")
+            decisions[Candidate(kind, text)] = accepted
+    return decisions
+
+
+def save_decisions(path, decisions):
+    data = {NOTE: {}, SHORTDESC: {}}
+    for candidate, accepted in decisions.items():
+        data[candidate.kind][candidate.text] = accepted
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def options_with_decisions(options, decisions):
+    # Options that answer the converter's questions from decisions, for
+    # conversions without anyone to ask; undecided candidates are accepted.
+    return replace(options,
+                   confirm_note=lambda text: decisions.get(Candidate(NOTE, text), True),
+                   confirm_shortdesc=lambda text: decisions.get(Candidate(SHORTDESC, text), True))
@@ -0,0 +1,114 @@
+import os
+import posixpath
+import xml.etree.ElementTree as ET
+
+from ditafy.converter import (ConversionOptions, DocumentContext, ParsedDocument, build_topics, dita_id,
+                              profile_stage, write_topic)
+from ditafy.reader import Paragraph, Table, open_source
+from ditafy.styles import HEADING, build_heading_levels
+from ditafy.writer import write_dita
+
+
+def topic_dir_for(map_path):
+    # Topics of "manual.ditamap" go to "manual/" next to it
+    return os.path.splitext(map_path)[0]
+
+
+class _MapWriter:
+    # Writes each finished section as a topic and records it in the map,
+    # nested under the closest preceding section of a higher level.
+
+    def __init__(self, source, map_path, map_id, options, context):
+        self.source = source
+        self.options = options
+        self.context = context
+        self.topic_dir = topic_dir_for(map_path)
+        self.href_prefix = os.path.basename(self.topic_dir)
+        self.map = ET.Element('map', id=map_id)
+        self.title = ET.SubElement(self.map, 'title')
+        # (heading level, element) from the map down to the open topicref
+        self.parents = [(0, self.map)]
+        self.used_ids = set()
+        os.makedirs(self.topic_dir, exist_ok=True)
+
+    def _topic_id(self, title):
+        base = dita_id(title) if title else 'topic'
+        topic_id = base
+        suffix = 2
+        while topic_id.casefold() in self.used_ids:
+            topic_id = f'{base}-{suffix}'
+            suffix += 1
+        self.used_ids.add(topic_id.casefold())
+        return topic_id
+
+    def add(self, blocks, level):
+        # blocks starts with the heading (or document title) of the section
+        topic_id = self._topic_id(blocks[0].text.strip())
+        section = ParsedDocument(self.source, blocks)
+        topics = build_topics(section, topic_id, [self.options.topic_type], self.options, self.context)
+        root = next(iter(topics.values()))
+        file_name = f'{topic_id}.dita'
+        write_topic(root, os.path.join(self.topic_dir, file_name), self.options)
+
+        while self.parents[-1][0] >= level:
+            self.parents.pop()
+        topicref = ET.SubElement(self.parents[-1][1], 'topicref',
+                                 href=posixpath.join(self.href_prefix, file_name), type=root.tag)
+        self.parents.append((level, topicref))
+
+
+def split_docx(source, map_path, map_id, options=None, split_level=2):
+    """Convert one document into a topic per heading and a .ditamap of them.
+
+    Every heading of split_level or above (Heading 1 is the highest) starts
+    a new topic, titled by the heading; lower headings stay inside it. The
+    document's first paragraph, unless it is such a heading, titles the map
+    and any content before the first heading becomes an introductory topic.
+    Topics are written to a folder named after the map as soon as their
+    section ends, so only one section is held in memory at a time.
+    """
+    options = options or ConversionOptions()
+    with profile_stage(options, 'load'):
+        docx_source = open_source(source, streaming=options.streaming)
+    try:
+        context = DocumentContext(docx_source, options)
+        heading_levels = build_heading_levels(docx_source.styles)
+        writer = _MapWriter(docx_source, map_path, map_id, options, context)
+
+        def split_level_of(block):
+            # Heading level of a block that starts a new topic, else None
+            if isinstance(block, Table) or context.role(block) != HEADING or not block.text.strip():
+                return None
+            level = heading_levels.get(block.style_id, 1)
+            return level if level <= split_level else None
+
+        section = []
+        section_level = 1
+        # The introduction is written only when it holds more than the title
+        intro = True
+        for block in docx_source.blocks():
+            level = split_level_of(block)
+            if level is not None:
+                if section and not (intro and len(section) == 1):
+                    writer.add(section, section_level)
+                section = [block]
+                section_level = level
+                intro = False
+                continue
+            if not section:
+                if not isinstance(block, Table):
+                    writer.title.text = block.text
+                    section = [block]
+                    continue
+                section = [Paragraph(None, map_id, None, None, ())]
+            # Table rows are read lazily and must be kept before moving on
+            section.append(Table(list(block.rows)) if isinstance(block, Table) else block)
+        if section and not (intro and len(section) == 1):
+            writer.add(section, section_level)
+    finally:
+        docx_source.close()
+
+    if writer.title.text is None:
+        writer.title.text = map_id
+    write_dita(writer.map, map_path)
+    return writer.map
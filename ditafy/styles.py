@@ -0,0 +1,229 @@
+import json
+import os
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+try:
+    import yaml
+except ImportError:
+    # Only YAML rules files need PyYAML
+    yaml = None
+
+# Roles a paragraph can play in a converted topic
+STEP = 'step'
+SUBSTEP = 'substep'
+NOTE = 'note'
+INFO = 'info'
+TITLE = 'title'
+# Opens a <section> in concepts and references; plain info in tasks
+HEADING = 'heading'
+ROLES = (STEP, SUBSTEP, NOTE, INFO, TITLE, HEADING)
+# Roles a list level can be given (see DEFAULT_NUMBERING_ROLES)
+LIST_ROLES = (STEP, SUBSTEP, NOTE, INFO)
+# Values of <note type="...">
+NOTE_TYPES = ('note', 'tip', 'fastpath', 'restriction', 'important', 'remember', 'attention', 'caution',
+              'notice', 'danger', 'warning', 'trouble', 'other')
+_NOTE_ATTRIBUTES = ('type', 'othertype')
+
+# A rule's target: a role, with attributes for the element it becomes,
+# written as 'note type=caution'. Only notes take attributes.
+Target = namedtuple('Target', 'role attrib')
+
+# Style names (or ids or aliases, compared case-insensitively) and their
+# roles. Styles based on one of these inherit its role.
+DEFAULT_STYLE_ROLES = {
+    'List Paragraph': STEP,
+    'List Number': STEP,
+    'List Number 2': SUBSTEP,
+    'Title': TITLE,
+    **{f'Heading {level}': HEADING for level in range(1, 10)},
+}
+
+# Text prefixes that turn a paragraph into a note, with the prefix removed.
+# Each ends with a colon and is compared case-sensitively.
+DEFAULT_NOTE_PREFIXES = {
+    'Note:': NOTE,
+    'Tip:': 'note type=tip',
+    'Important:': 'note type=important',
+    'Caution:': 'note type=caution',
+    'Warning:': 'note type=warning',
+    'Danger:': 'note type=danger',
+}
+
+# Word list level (1-9) -> role for the numbered paragraphs at that level
+# whose style is a step, substep or info style. Unlisted levels nest as
+# list items.
+DEFAULT_NUMBERING_ROLES = {}
+
+
+@lru_cache(maxsize=None)
+def parse_target(text):
+    # Target of a rule written 'role' or 'note type=caution othertype=...'
+    role, *pairs = text.split() or ['']
+    if role not in ROLES:
+        raise ValueError(f"Unknown role {role!r} in {text!r}, expected one of {', '.join(ROLES)}")
+    attrib = {}
+    for pair in pairs:
+        name, sep, value = pair.partition('=')
+        if not sep or not value:
+            raise ValueError(f"Expected name=value, found {pair!r} in {text!r}")
+        if role != NOTE or name not in _NOTE_ATTRIBUTES:
+            raise ValueError(f"{role} does not take a {name!r} attribute in {text!r}")
+        attrib[name] = value.strip('"\'')
+    if attrib.get('type', NOTE) not in NOTE_TYPES:
+        raise ValueError(f"Unknown note type {attrib['type']!r}, expected one of {', '.join(NOTE_TYPES)}")
+    return Target(role, tuple(sorted(attrib.items())))
+
+
+def _check_prefix(prefix, target):
+    if not prefix.endswith(':') or ':' in prefix[:-1]:
+        raise ValueError(f"Prefix {prefix!r} must end with its only colon")
+    if parse_target(target).role != NOTE:
+        raise ValueError(f"Prefix {prefix!r} must map to a note, not {target!r}")
+
+
+def _check_numbering(level, target):
+    if level not in [str(n) for n in range(1, 10)]:
+        raise ValueError(f"List level {level!r} must be 1 to 9")
+    if parse_target(target).role not in LIST_ROLES:
+        raise ValueError(f"List level {level} must map to one of {', '.join(LIST_ROLES)}, not {target!r}")
+
+
+def load_style_roles(path):
+    # Read a JSON object of style name -> role, merged over the defaults.
+    with open(path, 'r', encoding='utf-8') as f:
+        style_roles = json.load(f)
+    for style, role in style_roles.items():
+        parse_target(role)
+    return {**DEFAULT_STYLE_ROLES, **style_roles}
+
+
+def load_rules(path):
+    """Read a rules file and return it as ConversionOptions fields.
+
+    The file is JSON, or YAML when it ends in .yaml or .yml, with up to
+    three sections, each merged over its defaults:
+
+        {"styles": {"Warning Text": "note type=warning", "Procedure": "step"},
+         "prefixes": {"Caution:": "note type=caution", "NOTE:": "note"},
+         "numbering": {"3": "info"}}
+
+    styles maps style names to targets, prefixes maps text prefixes to
+    notes and numbering maps Word list levels to targets. A target is a
+    role, and notes may add type= and othertype= attributes.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        if os.path.splitext(path)[1].lower() in ('.yaml', '.yml'):
+            if yaml is None:
+                raise ValueError("YAML rules files need PyYAML (pip install pyyaml)")
+            rules = yaml.safe_load(f) or {}
+        else:
+            rules = json.load(f)
+    unknown = set(rules) - {'styles', 'prefixes', 'numbering'}
+    if unknown:
+        raise ValueError(f"Unknown rules section {sorted(unknown)[0]!r}, expected styles, prefixes or numbering")
+    sections = {name: {str(key): str(value) for key, value in (rules.get(name) or {}).items()}
+                for name in ('styles', 'prefixes', 'numbering')}
+    for target in sections['styles'].values():
+        parse_target(target)
+    for prefix, target in sections['prefixes'].items():
+        _check_prefix(prefix, target)
+    for level, target in sections['numbering'].items():
+        _check_numbering(level, target)
+    return {
+        'style_roles': {**DEFAULT_STYLE_ROLES, **sections['styles']},
+        'note_prefixes': {**DEFAULT_NOTE_PREFIXES, **sections['prefixes']},
+        'numbering_roles': {**DEFAULT_NUMBERING_ROLES, **sections['numbering']},
+    }
+
+
+def build_role_table(stylesheet, style_roles=None):
+    """Resolve every paragraph style of a document to a role once.
+
+    A style matches a style_roles entry by UI name, style id or any alias.
+    Unmatched styles take the role of the nearest style they are based on,
+    and fall back to INFO. The converter then needs one dict lookup per
+    paragraph; ids missing from the table are INFO too. Roles are kept as
+    written, so they may be targets such as 'note type=warning'.
+    """
+    if style_roles is None:
+        style_roles = DEFAULT_STYLE_ROLES
+    wanted = {name.casefold(): role for name, role in style_roles.items()}
+
+    direct = {}
+    for style_id, style in stylesheet.styles.items():
+        for name in (style.name, style_id) + style.aliases:
+            if name and name.casefold() in wanted:
+                direct[style_id] = wanted[name.casefold()]
+                break
+
+    table = dict(direct)
+    for style_id in stylesheet.styles:
+        chain = []
+        current = style_id
+        # Follow basedOn to the first resolved style; the chain check guards
+        # against cycles in malformed style sheets.
+        while current is not None and current not in table and current not in chain:
+            chain.append(current)
+            style = stylesheet.styles.get(current)
+            current = style.based_on if style is not None else None
+        role = table.get(current, INFO)
+        for resolved in chain:
+            table[resolved] = role
+    return table
+
+
+class RuleTable:
+    """Text prefix and list level rules, compiled for dict lookups.
+
+    Every prefix ends with its only colon, so a paragraph's candidate
+    prefix is its text up to the first colon, and finding its rule takes
+    one lookup however many rules there are.
+    """
+
+    def __init__(self, note_prefixes=None, numbering_roles=None):
+        if note_prefixes is None:
+            note_prefixes = DEFAULT_NOTE_PREFIXES
+        if numbering_roles is None:
+            numbering_roles = DEFAULT_NUMBERING_ROLES
+        for prefix, target in note_prefixes.items():
+            _check_prefix(prefix, target)
+        for level, target in numbering_roles.items():
+            _check_numbering(str(level), target)
+        self.prefixes = {prefix: parse_target(target) for prefix, target in note_prefixes.items()}
+        self.prefix_length = max(map(len, self.prefixes), default=0)
+        # By ilvl, which counts from 0
+        self.levels = {int(level) - 1: parse_target(target) for level, target in numbering_roles.items()}
+
+    def prefix(self, text):
+        # (target, text after the prefix) for a paragraph starting with a
+        # rule's prefix, or None
+        colon = text.find(':', 0, self.prefix_length)
+        target = self.prefixes.get(text[:colon + 1]) if colon >= 0 else None
+        return (target, text[colon + 1:].strip()) if target is not None else None
+
+
+def build_heading_levels(stylesheet):
+    # Outline level (1-9) of every style named like Word's "Heading N", or
+    # based on one. Styles mapped to the heading role some other way have
+    # no entry and count as level 1.
+    levels = {}
+    for style_id, style in stylesheet.styles.items():
+        for name in (style.name, style_id) + style.aliases:
+            match = re.fullmatch(r'heading\s*([1-9])', name or '', re.IGNORECASE)
+            if match:
+                levels[style_id] = int(match.group(1))
+                break
+
+    for style_id in stylesheet.styles:
+        chain = []
+        current = style_id
+        while current is not None and current not in levels and current not in chain:
+            chain.append(current)
+            style = stylesheet.styles.get(current)
+            current = style.based_on if style is not None else None
+        if current in levels:
+            for resolved in chain:
+                levels[resolved] = levels[current]
+    return levels
@@ -0,0 +1,117 @@
+import xml.etree.ElementTree as ET
+
+# Values for ConversionOptions.table_format
+AUTO = 'auto'
+CALS = 'table'
+SIMPLE = 'simpletable'
+TABLE_FORMATS = (AUTO, CALS, SIMPLE)
+
+
+def build_table(table, parent, table_format=AUTO, image_href=None, inline=None):
+    """Append a Table record (see ditafy.reader) to parent as DITA.
+
+    Rows are consumed once, in order, and every cell is handled in O(1):
+    horizontal merges become namest/nameend, and a vertical merge bumps
+    morerows on the entry that started it, found through a dict keyed by
+    grid column. With AUTO the result is a <simpletable> when no cell
+    spans or starts after skipped grid columns, otherwise a CALS <table>.
+    SIMPLE always produces a <simpletable>, dropping spans.
+    image_href(rel_id) returns an href for a picture in a cell, or None to
+    leave it out. inline, a ditafy.inline.InlineFormatter, keeps the
+    formatting of the cell text.
+    """
+    table_tag = ET.SubElement(parent, 'table')
+    tgroup = ET.SubElement(table_tag, 'tgroup')
+    thead = tbody = None
+    # Entry that began a vertical merge, by the grid column it starts in
+    merges = {}
+    columns = 0
+    spans = False
+
+    for row in table.rows:
+        if row.header and tbody is None:
+            if thead is None:
+                thead = ET.SubElement(tgroup, 'thead')
+            section = thead
+        else:
+            if tbody is None:
+                tbody = ET.SubElement(tgroup, 'tbody')
+                merges.clear()
+            section = tbody
+        row_tag = ET.SubElement(section, 'row')
+
+        column = row.grid_before
+        expected = 0
+        for cell in row.cells:
+            start = merges.get(column) if cell.vmerge == 'continue' else None
+            if start is not None:
+                start.set('morerows', str(int(start.get('morerows', '0')) + 1))
+                spans = True
+            else:
+                entry = ET.SubElement(row_tag, 'entry')
+                if column != expected:
+                    # After skipped grid columns (w:gridBefore or a merge),
+                    # which only a CALS table can place
+                    entry.set('colname', f'c{column + 1}')
+                    spans = True
+                if cell.span > 1:
+                    entry.set('namest', f'c{column + 1}')
+                    entry.set('nameend', f'c{column + cell.span}')
+                    spans = True
+                _fill_entry(entry, cell, image_href, inline)
+                if cell.vmerge == 'restart':
+                    merges[column] = entry
+                else:
+                    merges.pop(column, None)
+                expected = column + cell.span
+            column += cell.span
+        columns = max(columns, column)
+
+    tgroup.set('cols', str(columns))
+    for column in range(columns, 0, -1):
+        tgroup.insert(0, ET.Element('colspec', colname=f'c{column}', colnum=str(column)))
+
+    if table_format == SIMPLE or table_format == AUTO and not spans:
+        _to_simpletable(table_tag)
+    return table_tag
+
+
+def _fill_entry(entry, cell, image_href, inline):
+    paragraphs = [text.strip() for text in cell.paragraphs]
+    runs = cell.runs if inline is not None and cell.runs else [None] * len(paragraphs)
+    if len(paragraphs) <= 1:
+        entry.text = paragraphs[0] if paragraphs else ''
+        if runs and runs[0]:
+            inline.fill(entry, runs[0], paragraphs[0])
+    else:
+        for text, paragraph_runs in zip(paragraphs, runs):
+            if text:
+                paragraph = ET.SubElement(entry, 'p')
+                if paragraph_runs:
+                    inline.fill(paragraph, paragraph_runs, text)
+                else:
+                    paragraph.text = text
+    if image_href is not None:
+        for rel_id in cell.image_rel_ids:
+            href = image_href(rel_id)
+            if href:
+                ET.SubElement(entry, 'image', href=href)
+
+
+def _to_simpletable(table_tag):
+    # Re-tag a CALS table in place: the first header row becomes <sthead>,
+    # every other row a <strow>, entries <stentry>.
+    tgroup = table_tag[0]
+    table_tag.remove(tgroup)
+    table_tag.tag = 'simpletable'
+    has_header = False
+    for section in tgroup:
+        if section.tag == 'colspec':
+            continue
+        for row in section:
+            row.tag = 'sthead' if section.tag == 'thead' and not has_header else 'strow'
+            has_header = has_header or row.tag == 'sthead'
+            for entry in row:
+                entry.tag = 'stentry'
+                entry.attrib.clear()
+            table_tag.append(row)
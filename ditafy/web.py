@@ -0,0 +1,369 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from dataclasses import replace
+
+from flask import Flask, Request, Response, current_app, jsonify, request, send_file, url_for
+
+from ditafy.batch import task_id_from_path
+from ditafy.converter import (AUTO_TOPIC, TASK, TOPIC_TYPES, ConversionOptions, convert_docx, dita_id,
+                              docx_to_dita_task, profile_stage)
+from ditafy.keywords import check_phrase_rules, parse_replacements
+from ditafy.preferences import PreferencesStore, compiled_matcher
+from ditafy.profiling import HEADER, JsonLinesWriter, PrometheusMetrics, StageProfiler, profile_target_from_env
+from ditafy.styles import load_rules
+from ditafy.writer import indent_tree, iter_dita
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def _run_job(docx_path, dita_path, task_id, keyword_replacements, options, profile=False, persist=True):
+    # Returns the profile record when profile is set. Each worker process
+    # compiles a keyword table once, or loads it from the matcher cache;
+    # persist=False keeps tables typed by clients out of that cache.
+    options = replace(options, keyword_matcher=compiled_matcher(keyword_replacements, persist=persist))
+    if not profile:
+        docx_to_dita_task(docx_path, dita_path, task_id, options)
+        return None
+    profiler = StageProfiler()
+    with profiler.document(task_id) as record:
+        docx_to_dita_task(docx_path, dita_path, task_id, replace(options, profiler=profiler))
+    return record
+
+
+class JobQueue:
+    """Runs conversions on a bounded process pool, one temp directory per job.
+
+    At most max_pending jobs may be queued or running at once; submit()
+    returns None beyond that so the caller can ask the client to retry.
+    Finished jobs and their files are removed after job_ttl seconds.
+    on_profile(record) receives the profile of each profiled job.
+    """
+
+    def __init__(self, workers=None, max_pending=64, job_ttl=3600, work_dir=None, on_profile=None):
+        self.executor = ProcessPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending
+        self.job_ttl = job_ttl
+        self.work_dir = work_dir
+        self.on_profile = on_profile
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def create(self):
+        # Reserve a slot and a temp directory for a new job.
+        self.expire()
+        with self.lock:
+            pending = sum(1 for job in self.jobs.values() if job['status'] in (QUEUED, RUNNING))
+            if pending >= self.max_pending:
+                return None
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {
+                'id': job_id,
+                'status': QUEUED,
+                'error': None,
+                'dir': tempfile.mkdtemp(prefix=f'ditafy-{job_id}-', dir=self.work_dir),
+                'finished': None,
+            }
+            return self.jobs[job_id]
+
+    def submit(self, job, docx_path, task_id, keyword_replacements, options, profile=False, persist=True):
+        # Raises ValueError when task_id would put the output outside the job directory
+        dita_path = os.path.join(job['dir'], f'{task_id}.dita')
+        job_dir = os.path.realpath(job['dir'])
+        if os.path.dirname(os.path.realpath(dita_path)) != job_dir:
+            raise ValueError(f"Invalid task ID {task_id!r}")
+        job['task_id'] = task_id
+        job['dita_path'] = dita_path
+        job['future'] = self.executor.submit(_run_job, docx_path, job['dita_path'], task_id,
+                                             keyword_replacements, options, profile, persist)
+        job['future'].add_done_callback(lambda future: self._finish(job, future))
+
+    def _finish(self, job, future):
+        if future.cancelled():
+            error, message = True, "Cancelled"
+        else:
+            error = future.exception()
+            message = f"{type(error).__name__}: {error}" if error else None
+        profile = future.result() if error is None else None
+        with self.lock:
+            job['status'] = FAILED if error else DONE
+            job['error'] = message
+            job['profile'] = profile
+            job['finished'] = time.monotonic()
+        if profile is not None and self.on_profile is not None:
+            self.on_profile(profile)
+
+    def get(self, job_id):
+        self.expire()
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job and job['status'] == QUEUED and job.get('future') and job['future'].running():
+                job['status'] = RUNNING
+            return job
+
+    def discard(self, job_id, force=False):
+        # Remove a job and its files, or None when there is no such job. A
+        # queued job is cancelled first; one that is running (or not yet
+        # submitted) is returned unfinished and kept, unless force is set,
+        # since its worker still writes into the directory.
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        future = job.get('future')
+        # cancel() runs _finish, which takes the lock
+        if not force and job['finished'] is None and (future is None or not future.cancel()):
+            return job
+        with self.lock:
+            self.jobs.pop(job_id, None)
+        shutil.rmtree(job['dir'], ignore_errors=True)
+        return job
+
+    def expire(self):
+        now = time.monotonic()
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job['finished'] is not None and now - job['finished'] > self.job_ttl]
+        for job_id in expired:
+            self.discard(job_id)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for job_id in list(self.jobs):
+            self.discard(job_id, force=True)
+
+
+class SpooledRequest(Request):
+    # Keep uploaded files in memory up to SPOOL_THRESHOLD bytes and spill
+    # to a temporary file only above it.
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=current_app.config['SPOOL_THRESHOLD'], mode='rb+')
+
+
+def _form_flag(name, default):
+    value = request.form.get(name)
+    if value is None:
+        return default
+    return value.lower() in ('true', '1', 'yes', 'on')
+
+
+def _status(job):
+    body = {'success': job['status'] != FAILED, 'jobId': job['id'], 'status': job['status']}
+    if job['error']:
+        body['message'] = job['error']
+    if job['status'] == DONE:
+        body['resultUrl'] = url_for('job_result', job_id=job['id'])
+    if job.get('profile'):
+        body['profile'] = job['profile']
+    return body
+
+
+def _wants_profile():
+    return current_app.config['PROFILE'] or request.headers.get(HEADER, '').lower() in ('1', 'true', 'yes', 'on')
+
+
+def _form_task_id(input_file):
+    # taskId from the form made safe as an ID and file name, or else one
+    # taken from the uploaded file name
+    task_id = request.form.get('taskId', '').strip()
+    return dita_id(task_id) if task_id else task_id_from_path(input_file.filename)
+
+
+def _form_options():
+    return ConversionOptions(
+        check_for_notes=_form_flag('checkForNotes', True),
+        detect_shortdesc=_form_flag('detectShortdesc', True),
+        topic_type=request.form.get('topicType', TASK),
+        **current_app.config['RULES'],
+    )
+
+
+def _form_typed():
+    # Whether the form brings its own replacements rather than a profile
+    return bool(request.form.get('preferences', '').strip())
+
+
+def _typed_keywords():
+    # Replacements typed into the form. Clients are not trusted with regular
+    # expressions, so their rules may only stand for phrases.
+    keyword_replacements = parse_replacements(request.form.get('preferences', ''))
+    check_phrase_rules(keyword_replacements)
+    return keyword_replacements
+
+
+def _form_keywords():
+    # Replacements typed into the form, or else those of the stored profile
+    # named by preferencesProfile (the default profile without one)
+    if _form_typed():
+        return _typed_keywords()
+    store = current_app.extensions['ditafy_preferences']
+    if store is None:
+        return {}
+    return store.keywords(request.form.get('preferencesProfile') or None)
+
+
+def _form_matcher():
+    # Compiled _form_keywords(); stored profiles are compiled once per
+    # change, typed tables are only kept in memory
+    store = current_app.extensions['ditafy_preferences']
+    if store is None or _form_typed():
+        return compiled_matcher(_form_keywords(), persist=not _form_typed())
+    return store.matcher(request.form.get('preferencesProfile') or None)
+
+
+def _form_error():
+    # Response for an unusable upload or form, or None when it is fine
+    input_file = request.files.get('inputFile')
+    if input_file is None or not input_file.filename.lower().endswith('.docx'):
+        return jsonify(success=False, message="Please upload a .docx file as inputFile."), 400
+    if request.form.get('topicType', TASK) not in TOPIC_TYPES + (AUTO_TOPIC,):
+        message = f"topicType must be one of {', '.join(TOPIC_TYPES + (AUTO_TOPIC,))}."
+        return jsonify(success=False, message=message), 400
+    try:
+        # Compiled now so a bad rule is reported; conversions reuse it
+        compiled_matcher(_typed_keywords(), persist=False)
+    except ValueError as e:
+        return jsonify(success=False, message=f"preferences: {e}"), 400
+    profile = request.form.get('preferencesProfile')
+    store = current_app.extensions['ditafy_preferences']
+    if store is not None:
+        store.reload_if_changed()
+    if profile and (store is None or profile not in store.profile_names()):
+        return jsonify(success=False, message=f"Unknown preferences profile {profile!r}."), 400
+    return None
+
+
+def create_app(workers=None, max_pending=64, job_ttl=3600,
+               max_upload_size=64 * 1024 * 1024, spool_threshold=8 * 1024 * 1024,
+               profile=None, profile_log=None, preferences=None, rules=None):
+    # profile turns per-stage profiling on for every conversion; otherwise
+    # only requests with the X-Ditafy-Profile header are profiled. Profiles
+    # add up in /metrics and, with profile_log, are written as JSON lines.
+    # Both default to the DITAFY_PROFILE environment variable.
+    # preferences is a preferences file (see ditafy.preferences) whose
+    # profiles requests can pick; it is read again when it changes. rules
+    # is a rules file (see ditafy.styles.load_rules) for every conversion.
+    env_target = profile_target_from_env()
+    if profile is None:
+        profile = env_target is not None
+    if profile_log is None:
+        profile_log = env_target
+
+    app = Flask(__name__)
+    # Larger uploads are rejected with 413 before they are read
+    app.config['MAX_CONTENT_LENGTH'] = max_upload_size
+    app.config['SPOOL_THRESHOLD'] = spool_threshold
+    app.config['PROFILE'] = profile
+    app.config['RULES'] = load_rules(rules) if rules else {}
+    app.request_class = SpooledRequest
+
+    metrics = PrometheusMetrics()
+    profile_writer = JsonLinesWriter(profile_log) if profile_log else None
+
+    def record_profile(record):
+        metrics.add(record)
+        if profile_writer is not None:
+            profile_writer.write(record)
+
+    jobs = JobQueue(workers=workers, max_pending=max_pending, job_ttl=job_ttl, on_profile=record_profile)
+    app.extensions['ditafy_jobs'] = jobs
+    app.extensions['ditafy_metrics'] = metrics
+    app.extensions['ditafy_preferences'] = PreferencesStore(preferences) if preferences else None
+
+    @app.route('/convert', methods=['POST'])
+    def convert():
+        error = _form_error()
+        if error is not None:
+            return error
+        input_file = request.files['inputFile']
+
+        job = jobs.create()
+        if job is None:
+            response = jsonify(success=False, message="Too many conversions in progress, try again later.")
+            response.headers['Retry-After'] = '5'
+            return response, 503
+
+        docx_path = os.path.join(job['dir'], 'input.docx')
+        input_file.save(docx_path)
+
+        try:
+            jobs.submit(job, docx_path, _form_task_id(input_file), _form_keywords(), _form_options(),
+                        profile=_wants_profile(), persist=not _form_typed())
+        except ValueError as e:
+            jobs.discard(job['id'], force=True)
+            return jsonify(success=False, message=str(e)), 400
+
+        response = jsonify(_status(job))
+        response.headers['Location'] = url_for('job_status', job_id=job['id'])
+        return response, 202
+
+    @app.route('/convert/stream', methods=['POST'])
+    def convert_stream():
+        # Convert in the request thread straight from the uploaded stream and
+        # stream the DITA back, without touching disk for small uploads.
+        error = _form_error()
+        if error is not None:
+            return error
+        input_file = request.files['inputFile']
+
+        task_id = _form_task_id(input_file)
+        profiler = StageProfiler() if _wants_profile() else None
+        options = replace(_form_options(), profiler=profiler, keyword_matcher=_form_matcher())
+        record = None
+        try:
+            with profiler.document(task_id) if profiler is not None else nullcontext() as record:
+                root = convert_docx(input_file.stream, task_id, options)
+                # Writing happens as the response streams, outside the profile
+                with profile_stage(options, 'pretty_print'):
+                    indent_tree(root)
+        except Exception as e:
+            return jsonify(success=False, message=str(e)), 422
+        finally:
+            input_file.close()
+
+        headers = {'Content-Disposition': f'attachment; filename="{task_id}.dita"'}
+        if record is not None:
+            record_profile(record)
+            headers[HEADER] = json.dumps(record, separators=(',', ':'))
+        return Response(iter_dita(root, indent=None), mimetype='application/xml', headers=headers)
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/jobs/<job_id>', methods=['GET'])
+    def job_status(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify(success=False, message="Unknown job."), 404
+        return jsonify(_status(job))
+
+    @app.route('/jobs/<job_id>/result', methods=['GET'])
+    def job_result(job_id):
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify(success=False, message="Unknown job."), 404
+        if job['status'] != DONE:
+            return jsonify(_status(job)), 409
+        return send_file(job['dita_path'], mimetype='application/xml', as_attachment=True,
+                         download_name=os.path.basename(job['dita_path']))
+
+    @app.route('/jobs/<job_id>', methods=['DELETE'])
+    def job_delete(job_id):
+        job = jobs.discard(job_id)
+        if job is None:
+            return jsonify(success=False, message="Unknown job."), 404
+        if job['finished'] is None:
+            return jsonify(success=False, message="The job is still running, delete it once it has finished."), 409
+        return jsonify(success=True)
+
+    return app
@@ -0,0 +1,57 @@
+import xml.etree.ElementTree as ET
+
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+DOCTYPES = {
+    'task': '<!DOCTYPE task PUBLIC "-//OASIS//DTD DITA Task//EN" "task.dtd">\n',
+    'concept': '<!DOCTYPE concept PUBLIC "-//OASIS//DTD DITA Concept//EN" "concept.dtd">\n',
+    'reference': '<!DOCTYPE reference PUBLIC "-//OASIS//DTD DITA Reference//EN" "reference.dtd">\n',
+    'map': '<!DOCTYPE map PUBLIC "-//OASIS//DTD DITA Map//EN" "map.dtd">\n',
+}
+
+
+# Elements that only occur inside text, where added whitespace would show
+INLINE_TAGS = {'b', 'i', 'u', 'sup', 'sub', 'codeph', 'uicontrol', 'xref', 'ph', 'keyword', 'term', 'tm'}
+
+
+def indent_tree(root, space='  '):
+    # Like ET.indent, but leaves mixed content (text beside elements, or
+    # inline elements) as it is, since whitespace there is part of the text.
+    def indent_children(element, level):
+        children = list(element)
+        if not children or element.text and element.text.strip():
+            return
+        if any(child.tag in INLINE_TAGS or child.tail and child.tail.strip() for child in children):
+            return
+        child_indent = '\n' + space * (level + 1)
+        element.text = child_indent
+        for child in children:
+            indent_children(child, level + 1)
+            child.tail = child_indent
+        children[-1].tail = '\n' + space * level
+
+    indent_children(root, 0)
+
+
+def write_dita(root, dita_path, indent='  '):
+    # Indent the tree in place (unless indent is None) and stream it
+    # straight to disk, with the XML declaration and the DOCTYPE matching
+    # the root element.
+    if indent is not None:
+        indent_tree(root, space=indent)
+    with open(dita_path, 'w', encoding='utf-8') as f:
+        f.write(XML_DECLARATION)
+        f.write(DOCTYPES[root.tag])
+        ET.ElementTree(root).write(f, encoding='unicode')
+        f.write('\n')
+
+
+def iter_dita(root, indent='  '):
+    # Same document as write_dita, yielded as UTF-8 chunks for streaming
+    # responses without a file on disk.
+    if indent is not None:
+        indent_tree(root, space=indent)
+    yield (XML_DECLARATION + DOCTYPES[root.tag]).encode('utf-8')
+    for chunk in ET.tostringlist(root, encoding='unicode'):
+        yield chunk.encode('utf-8')
+    yield b'\n'
@@ -1,43 +1,53 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, Menu, Toplevel
-import json
-import xml.etree.ElementTree as ET
-from docx import Document
-import xml.dom.minidom
 import os
+from ditafy.keywords import parse_replacements
+from ditafy.converter import ConversionCancelled, ConversionOptions, write_topic
+from ditafy.gui import ConversionPanel, review_candidates
+from ditafy.review import ReviewedConversion, decisions_path_for, load_decisions
+from ditafy.images import ImageWriter, save_blob
+from ditafy.preferences import DEFAULT_PROFILE, PreferencesStore
+from ditafy.styles import load_rules
 from PIL import Image, ImageTk
 import io
 
-# Global variable for storing keyword replacements
-keyword_replacements = {}
+# Keyword replacement profiles, read again whenever preferences.json changes
+preferences = PreferencesStore('preferences.json')
+
+# Style, note prefix and list level rules from rules.yaml or rules.json, if present
+conversion_rules = {}
+for rules_file in ('rules.yaml', 'rules.yml', 'rules.json'):
+    if os.path.exists(rules_file):
+        conversion_rules = load_rules(rules_file)
+        break
 
 def save_preferences():
-    global keyword_replacements
     try:
-        prefs = preferences_text.get("1.0", tk.END).strip().split('\n')
-        keyword_replacements = {}
-        for pref in prefs:
-            if ':' in pref:
-                original, new = map(str.strip, pref.split(':', 1))
-                keyword_replacements[original] = new
-        
-        with open('preferences.json', 'w') as f:
-            json.dump(keyword_replacements, f)
+        name = profile_name_entry.get().strip() or DEFAULT_PROFILE
+        preferences.set_keywords(name, parse_replacements(preferences_text.get("1.0", tk.END)))
+        refresh_profiles()
+        selected_profile.set(name)
         messagebox.showinfo("Preferences Saved", "Keyword replacements saved successfully.")
     except Exception as e:
         messagebox.showerror("Error", f"An error occurred while saving preferences:\n{str(e)}")
 
 def open_preferences_dialog():
-    global preferences_text
+    global preferences_text, profile_name_entry
     preferences_window = tk.Toplevel(root)
     preferences_window.title("Keyword Replacements")
     
+    tk.Label(preferences_window, text="Profile (a new name creates a profile):").pack(padx=10, pady=(10, 0), anchor=tk.W)
+    profile_name_entry = tk.Entry(preferences_window, width=40)
+    profile_name_entry.insert(0, selected_profile.get())
+    profile_name_entry.pack(padx=10, pady=5, anchor=tk.W)
+    
     tk.Label(preferences_window, text="Specify replacements in the format 'ORIGINALPHRASE : NEWPHRASE'").pack(padx=10, pady=5)
+    tk.Label(preferences_window, text="For rules, write '/PATTERN/FLAGS : NEWPHRASE', e.g. '/widgets?/iw : Widget' (i: ignore case, w: whole words only)").pack(padx=10, pady=(0, 5))
     
     preferences_text = tk.Text(preferences_window, width=80, height=20)
     preferences_text.pack(padx=10, pady=5)
     
-    current_prefs = '\n'.join([f"{key} : {value}" for key, value in keyword_replacements.items()])
+    current_prefs = '\n'.join([f"{key} : {value}" for key, value in preferences.keywords(selected_profile.get()).items()])
     preferences_text.insert(tk.END, current_prefs)
     
     tk.Button(preferences_window, text="Save Preferences", command=save_preferences).pack(padx=10, pady=10)
@@ -69,8 +79,7 @@ def save_image_with_preview(img_data):
         if save:
             image_path[0] = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG files", "*.png"), ("JPEG files", "*.jpg"), ("All files", "*.*")])
             if image_path[0]:
-                image = Image.open(io.BytesIO(img_data))
-                image.save(image_path[0])
+                save_blob(img_data, image_path[0])
         window.destroy()
     
     preview_window = preview_image(img_data, next_image_callback)
@@ -78,105 +87,81 @@ def save_image_with_preview(img_data):
     return image_path[0]
 
 def docx_to_dita_task(docx_path, dita_path, task_id):
-    doc = Document(docx_path)
-    
-    root = ET.Element('task', id=task_id)
-    
-    title = ET.SubElement(root, 'title')
-    title.text = doc.paragraphs[0].text
-    
-    # Insert shortdesc after title if applicable
-    shortdesc_added = False
-    next_para = doc.paragraphs[1].text.strip()
-    if not (doc.paragraphs[1].style.name == 'List Paragraph' or doc.paragraphs[1].style.name == 'List Number' or doc.paragraphs[1].style.name == 'List Number 2'):
-        response = messagebox.askyesno("Short Description Detected", f"Is this the short description?\n\n{next_para}")
-        if response:
-            shortdesc = ET.SubElement(root, 'shortdesc')
-            shortdesc.text = next_para
-            shortdesc_added = True
-    
-    task_body = ET.SubElement(root, 'taskbody')
-    steps = ET.SubElement(task_body, 'steps')
-    
-    current_step = None
-    current_substeps = None
-
-    for para in doc.paragraphs[1:]:
-        para_text = para.text.strip()
-        
-        # Skip the paragraph if it's already added as shortdesc
-        if shortdesc_added and para_text == next_para:
-            shortdesc_added = False  # Reset the flag after skipping the paragraph
-            continue
-        
-        if check_for_notes.get() and para_text.startswith("Note:"):
-            note_content = para_text[5:].strip()
-            if prompt_for_notes.get():
-                response = messagebox.askyesno("Note Detected", f"Is this a note?\n\n{note_content}")
-                if response:
-                    note_tag = ET.Element('note')
-                    note_tag.text = note_content
-                    info_tag = ET.SubElement(current_step if current_step else steps, 'info')
-                    info_tag.append(note_tag)
-                else:
-                    if current_step is not None:
-                        step_info = ET.SubElement(current_step, 'info')
-                        step_info.text = note_content
-                    else:
-                        para_tag = ET.SubElement(steps, 'info')
-                        para_tag.text = note_content
-            else:
-                note_tag = ET.Element('note')
-                note_tag.text = note_content
-                info_tag = ET.SubElement(current_step if current_step else steps, 'info')
-                info_tag.append(note_tag)
-        elif para.style.name == 'List Paragraph' or para.style.name == 'List Number':
-            current_step = ET.SubElement(steps, 'step')
-            step_cmd = ET.SubElement(current_step, 'cmd')
-            step_cmd.text = para_text
-        elif para.style.name == 'List Number 2':
-            if current_step is not None:
-                if current_substeps is None:
-                    current_substeps = ET.SubElement(current_step, 'substeps')
-                substep = ET.SubElement(current_substeps, 'substep')
-                substep_cmd = ET.SubElement(substep, 'cmd')
-                substep_cmd.text = para_text
+    # Converts on the conversion panel's worker thread so the window stays
+    # responsive. Notes and the short description are reviewed together once
+    # the document has been read, and image dialogs are shown on the main loop.
+    # Decisions saved by an earlier review of the document are reused, and
+    # the review is skipped when they cover every candidate.
+    # Without "Ask for Each Image Path", images go to an images folder next
+    # to the output file without any dialogs.
+    image_writer = None
+    save_image = lambda blob: conversion_panel.ask(save_image_with_preview, blob)
+    if include_images.get() and not ask_for_image_paths.get():
+        image_writer = ImageWriter(os.path.join(os.path.dirname(os.path.abspath(dita_path)), 'images'),
+                                   name_template='{task_id}-{index}{ext}')
+        save_image = image_writer.saver(task_id, dita_path)
+
+    phase = ["Converting"]
+
+    def progress(kind, count):
+        if kind == 'image':
+            conversion_panel.report(f"Saved image {count}")
         else:
-            if current_step is not None:
-                step_info = ET.SubElement(current_step, 'info')
-                step_info.text = para_text
-            else:
-                para_tag = ET.SubElement(steps, 'info')
-                para_tag.text = para_text
-    
-    for rel in doc.part.rels.values():
-        if "image" in rel.target_ref:
-            if include_images.get():
-                img = rel.target_part.blob
-                image_path = save_image_with_preview(img)
-                if image_path:
-                    if current_step is not None:
-                        info_tag = ET.SubElement(current_step, 'info')
-                        fig_tag = ET.SubElement(info_tag, 'fig')
-                        img_tag = ET.SubElement(fig_tag, 'image', href=image_path)
-    
-    xml_str = ET.tostring(root, encoding='utf-8', method='xml').decode('utf-8')
-    for original, new in keyword_replacements.items():
-        xml_str = xml_str.replace(original, new)
-        print(f"Replaced {original} with {new}")
-    root = ET.fromstring(xml_str)
-    
-    tree = ET.ElementTree(root)
-    xml_str = ET.tostring(root, encoding='utf-8', method='xml')
-    dom = xml.dom.minidom.parseString(xml_str)
-    pretty_xml_str = dom.toprettyxml(indent='  ')
-    pretty_xml_str = '\n'.join(pretty_xml_str.split('\n')[1:])
-    xml_declaration = '<?xml version="1.0" encoding="UTF-8"?>\n'
-    doctype = '<!DOCTYPE task PUBLIC "-//OASIS//DTD DITA Task//EN" "task.dtd">\n'
-    final_xml_str = xml_declaration + doctype + pretty_xml_str
-    
-    with open(dita_path, 'w', encoding='utf-8') as f:
-        f.write(final_xml_str)
+            total = len(conversion.document)
+            conversion_panel.report(f"{phase[0]}: paragraph {count} of {total}", count, total)
+
+    options = ConversionOptions(
+        check_for_notes=check_for_notes.get(),
+        include_images=include_images.get(),
+        keyword_matcher=preferences.matcher(selected_profile.get()),
+        save_image=save_image,
+        progress=progress,
+        **conversion_rules,
+    )
+    conversion = ReviewedConversion(docx_path, task_id, options, review_notes=prompt_for_notes.get())
+
+    def work(panel):
+        try:
+            panel.report("Reading document...")
+            candidates = conversion.prepare()
+            decisions_path = decisions_path_for(docx_path)
+            decisions = load_decisions(decisions_path) if os.path.exists(decisions_path) else {}
+            if any(candidate not in decisions for candidate in candidates):
+                decisions = panel.ask(review_candidates, root, candidates, decisions, decisions_path)
+            phase[0] = "Finishing"
+            task = conversion.finish(decisions)
+            panel.report("Writing output...")
+            write_topic(task, dita_path, options)
+        finally:
+            conversion.close()
+            if image_writer is not None:
+                image_writer.close()
+        return dita_path
+
+    convert_button.config(state=tk.DISABLED)
+    conversion_panel.start(work, conversion_done)
+
+def conversion_done(error, output_path):
+    convert_button.config(state=tk.NORMAL)
+    if error is None:
+        messagebox.showinfo("Success", f"Conversion completed successfully. Output saved to {output_path}")
+    elif not isinstance(error, ConversionCancelled):
+        messagebox.showerror("Error", f"An error occurred during conversion:\n{str(error)}")
+
+def refresh_profiles():
+    # Rebuild the profile menu, e.g. after preferences.json changed on disk
+    names = preferences.profile_names()
+    menu = profile_menu['menu']
+    menu.delete(0, tk.END)
+    for name in names:
+        menu.add_command(label=name, command=lambda name=name: selected_profile.set(name))
+    if selected_profile.get() not in names:
+        selected_profile.set(DEFAULT_PROFILE)
+
+def watch_preferences():
+    if preferences.reload_if_changed():
+        refresh_profiles()
+    root.after(2000, watch_preferences)
 
 def browse_file():
     filename = filedialog.askopenfilename(filetypes=[("Word files", "*.docx")])
@@ -208,11 +193,7 @@ def convert_file():
     if not output_path.lower().endswith('.dita'):
         output_path += '.dita'
     
-    try:
-        docx_to_dita_task(input_path, output_path, task_id)
-        messagebox.showinfo("Success", f"Conversion completed successfully. Output saved to {output_path}")
-    except Exception as e:
-        messagebox.showerror("Error", f"An error occurred during conversion:\n{str(e)}")
+    docx_to_dita_task(input_path, output_path, task_id)
 
 root = tk.Tk()
 root.title("DOCX to DITA Converter (version: IMGSKIP)")
@@ -269,9 +250,13 @@ convert_button.grid(row=7, column=1, padx=10, pady=10)
 preferences_button = tk.Button(root, text="Preferences", command=open_preferences_dialog)
 preferences_button.grid(row=7, column=2, padx=10, pady=10)
 
-preferences_file = 'preferences.json'
-if os.path.exists(preferences_file):
-    with open(preferences_file, 'r') as f:
-        keyword_replacements = json.load(f)
+selected_profile = tk.StringVar(value=DEFAULT_PROFILE)
+profile_menu = tk.OptionMenu(root, selected_profile, DEFAULT_PROFILE)
+profile_menu.grid(row=7, column=0, padx=10, pady=10, sticky=tk.W)
+refresh_profiles()
+
+conversion_panel = ConversionPanel(root)
+conversion_panel.grid(row=8, column=0, columnspan=3, padx=10, pady=(0, 10), sticky=tk.EW)
 
+watch_preferences()
 root.mainloop()
@@ -0,0 +1,26 @@
+import argparse
+from ditafy.web import create_app
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Run the DITAfy conversion service.")
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('-j', '--workers', type=int, default=None, help="conversion processes (default: CPU count)")
+    parser.add_argument('--max-pending', type=int, default=64, help="queued conversions before returning 503")
+    parser.add_argument('--max-upload-mb', type=int, default=64, help="largest accepted upload in MB")
+    parser.add_argument('--spool-mb', type=int, default=8, help="uploads above this size in MB are spooled to disk")
+    parser.add_argument('--profile', action='store_true', default=None,
+                        help="profile every conversion (default: only requests with an X-Ditafy-Profile header)")
+    parser.add_argument('--profile-log', help="also write each profile as a JSON line to this file")
+    parser.add_argument('-p', '--preferences', help="preferences file whose keyword profiles requests can pick "
+                                                    "with preferencesProfile; changes are picked up while running")
+    parser.add_argument('--rules', help="JSON or YAML file mapping style names, text prefixes and list levels "
+                                        "to roles and note types")
+    args = parser.parse_args()
+
+    app = create_app(workers=args.workers, max_pending=args.max_pending,
+                     max_upload_size=args.max_upload_mb * 1024 * 1024,
+                     spool_threshold=args.spool_mb * 1024 * 1024,
+                     profile=args.profile, profile_log=args.profile_log,
+                     preferences=args.preferences, rules=args.rules)
+    app.run(host=args.host, port=args.port, threaded=True)
@@ -0,0 +1,61 @@
+import base64
+import io
+
+import docx
+
+from ditafy.converter import ConversionOptions, convert_docx
+
+# A 1x1 PNG
+PIXEL = base64.b64decode('iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg==')
+
+
+def _convert(paragraphs):
+    # (style, text) pairs, text ending in a picture for (style, text,
+    # True), to a <task> without prompts. Pictures get the href img.png.
+    document = docx.Document()
+    for style, text, *picture in paragraphs:
+        paragraph = document.add_paragraph(text, style=style)
+        if picture:
+            paragraph.add_run().add_picture(io.BytesIO(PIXEL))
+    data = io.BytesIO()
+    document.save(data)
+    data.seek(0)
+    options = ConversionOptions(check_for_notes=False, detect_shortdesc=False,
+                                include_images=True, save_image=lambda blob: 'img.png')
+    return convert_docx(data, 'test', options)
+
+
+def _outline(element):
+    # Tags and text of the step's children, in document order
+    return [(child.tag, [cmd.text for cmd in child.iter('cmd')] or child.text) for child in element]
+
+
+def test_substep_after_info_keeps_document_order():
+    root = _convert([
+        ('Title', "Task"),
+        ('List Number', "Step"),
+        ('List Number 2', "Substep A"),
+        ('List Number 2', "Substep B"),
+        ('Normal', "Info after B"),
+        ('List Number 2', "Substep C"),
+    ])
+    step = root.find('taskbody/steps/step')
+    assert _outline(step) == [
+        ('cmd', ["Step"]),
+        ('substeps', ["Substep A", "Substep B"]),
+        ('info', "Info after B"),
+        ('substeps', ["Substep C"]),
+    ]
+
+
+def test_substep_image_stays_in_substep():
+    root = _convert([
+        ('Title', "Task"),
+        ('List Number', "Step"),
+        ('List Number 2', "Substep A", True),
+        ('List Number 2', "Substep B"),
+    ])
+    substeps = root.findall('taskbody/steps/step/substeps/substep')
+    assert [substep.findtext('cmd') for substep in substeps] == ["Substep A", "Substep B"]
+    assert substeps[0].find('info/fig/image').get('href') == 'img.png'
+    assert substeps[1].find('info') is None
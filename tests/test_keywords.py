@@ -0,0 +1,11 @@
+from ditafy.keywords import KeywordMatcher
+
+
+def test_rule_with_backreference():
+    matcher = KeywordMatcher({'/(a)\\1/': 'X', '/(?P<w>b)(?P=w)/i': 'Y', '/c+/': 'Z'})
+    assert matcher.replace_text('aab BB ccc a') == 'Xb Y Z a'
+
+
+def test_overlaps_resolved_across_matchers():
+    matcher = KeywordMatcher({'ab': 'X', 'cd': 'Y', 'de': 'Z', '/abc/i': 'W'})
+    assert matcher.replace_text('abcde') == 'WZ'